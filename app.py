@@ -1,11 +1,21 @@
 import openai
 import streamlit as st
 import pandas as pd
-from datetime import date
-from ga4_data_pull import fetch_ga4_extended_data, summarize_acquisition_sources, summarize_landing_pages
-from gsc_data_pull import fetch_search_console_data, summarize_search_queries
-from llm_integration import initialize_llm_context, query_gpt
-from urllib.parse import quote
+from datetime import date, timedelta
+from ga4_data_pull import LANDING_PAGE_ROWS, default_property_id, summarize_acquisition_sources, summarize_landing_pages
+from ga4_cube import compare_summaries, last_days, summarize_totals, window_cube, window_overall, window_totals
+from gsc_data_pull import summarize_search_queries
+from llm_integration import (
+    initialize_llm_context, stream_gpt, stream_gpt_batch, date_range_context, set_business_context, prime_answers,
+    SEARCH_QUERY_PROMPT, ACQUISITION_PROMPT, LANDING_PAGE_PROMPT,
+)
+from precompute_worker import build_snapshot
+from snapshot_store import MAX_SNAPSHOT_AGE_HOURS, load_latest_snapshot, snapshot_age_hours
+from llm_cache import response_cache
+from data_cache import cache
+from rate_limit import ApiError
+from tracing import recent_spans, rollup
+from handoff_store import SEO_HELPER_URL, handoff_link
 
 # Page configuration
 st.set_page_config(layout="wide")
@@ -14,27 +24,114 @@ st.markdown("<h1 style='text-align: center;'>Chelsea Whealdon Nutrition Website
 # Initialize LLM context with business context on app load
 initialize_llm_context()
 
-# Generate and display each summary with LLM analysis
-def display_report_with_llm(summary_func, llm_prompt):
-    # Generate summary
-    summary = summary_func()
+# Preset windows of the date range control in days, None covers all stored history
+DATE_RANGE_PRESETS = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All history": None, "Custom": None}
 
-    # Query LLM with specific prompt
-    llm_response = query_gpt(llm_prompt, summary)
-    return llm_response
+# Sidebar date range control over the days of the running GA4 totals, returns (start, end, previous period or None)
+# The previous period is the same number of days right before the range
+def select_date_range(ga_windows):
+    first_day, last_day = last_days(ga_windows)
+    preset = st.sidebar.selectbox("Date range", list(DATE_RANGE_PRESETS), index=3)
+    if preset == "Custom":
+        start, end = st.sidebar.slider(
+            "Days", min_value=first_day, max_value=last_day, value=(first_day, last_day), format="MMM D, YYYY"
+        )
+    else:
+        start, end = last_days(ga_windows, DATE_RANGE_PRESETS[preset])
+
+    previous = None
+    if st.sidebar.checkbox("Compare with previous period"):
+        previous_end = start - timedelta(days=1)
+        previous = (previous_end - (end - start), previous_end)
+    return start, end, previous
+
+# Headline numbers of the selected range, with the change against the previous period
+def display_kpis(ga_windows, start, end, previous):
+    def kpis(totals):
+        rate = totals["Leads"] / totals["Sessions"] * 100 if totals["Sessions"] else 0.0
+        return {"Sessions": totals["Sessions"], "Leads": totals["Leads"], "Conversion Rate": rate}
+
+    current = kpis(window_overall(ga_windows, start, end))
+    before = kpis(window_overall(ga_windows, *previous)) if previous else {}
+    for column, (label, value) in zip(st.columns(3), current.items()):
+        then = before.get(label)
+        shown = f"{value:.2f}%" if label == "Conversion Rate" else f"{value:,.0f}"
+        column.metric(label, shown, f"{(value / then - 1) * 100:+.1f}%" if then else None)
+
+# Summary table of one dimension, with the previous period's numbers alongside when comparing
+def with_previous_period(table, ga_windows, dimension, previous):
+    if not previous:
+        return table
+    return compare_summaries(table, summarize_totals(window_totals(ga_windows, dimension, *previous), dimension), dimension)
+
+# Shown after text that is still streaming in
+STREAMING_CURSOR = " ▌"
+
+# Run the section analyses concurrently and stream each answer into its placeholder as the text arrives
+# reports is a list of (placeholder, summary, prompt), answers are returned in the same order (None when one failed)
+def display_reports_with_llm(reports, context):
+    # Query LLM against the business context of the selected date range so each request (and therefore its
+    # cached answer) stays the same until the data or the range changes
+    jobs = [(llm_prompt, summary) for _, summary, llm_prompt in reports]
+    responses = [None] * len(reports)
+    for i, llm_response, done, error in stream_gpt_batch(jobs, context=context):
+        placeholder = reports[i][0]
+        if error is not None:
+            placeholder.error(f"The analysis could not be generated: {error}")
+        elif done:
+            placeholder.markdown(llm_response)
+            responses[i] = llm_response
+        else:
+            placeholder.markdown(llm_response + STREAMING_CURSOR)
+    return responses
+
+
+# The dashboard data as published by precompute_worker.py, built here on the first run or when asked to refresh
+# The precomputed analyses go into the response cache, so the matching requests below are answered without the API
+def load_snapshot(property_id):
+    refresh = st.sidebar.button("Refresh now")
+    snapshot = load_latest_snapshot(property_id)
+    if snapshot is None or refresh:
+        # Drop cached pulls so the snapshot is built from fresh data
+        cache.invalidate()
+        with st.spinner("Fetching and analysing the latest data..."):
+            build_snapshot(property_id)
+        snapshot = load_latest_snapshot(property_id)
+
+    if st.session_state.get("primed_snapshot") != snapshot["path"]:
+        prime_answers(snapshot["analyses"].get("answers", {}))
+        st.session_state["primed_snapshot"] = snapshot["path"]
+
+    age = snapshot_age_hours(snapshot)
+    st.sidebar.caption(f"Data through {snapshot['meta']['data_through']}, updated {age:.1f} hours ago")
+    if age > MAX_SNAPSHOT_AGE_HOURS:
+        st.sidebar.warning("This data is out of date, refresh it or check the precompute worker.")
+    return snapshot
 
 
 # Main function to handle the workflow
 def main():
     # Load and display data
-    ga_data = fetch_ga4_extended_data()
+    snapshot = load_snapshot(default_property_id())
+
+    # Running daily GA4 totals, any date range and its previous period are answered from them without a new fetch
+    ga_windows = snapshot["windows"]
+    start, end, previous = select_date_range(ga_windows)
+    ga_cube = window_cube(ga_windows, start, end)
+
+    # The analyses and follow-up questions are told which period the data covers
+    context = date_range_context(start, end)
+    set_business_context(context)
     # st.write("Google Analytics Data")
     # st.dataframe(ga_data)
 
-    search_data = fetch_search_console_data()
+    search_data = snapshot["search_data"]
     # st.write("Google Search Console Data")
     # st.dataframe(search_data)
 
+    st.markdown(f"<p style='text-align: center;'>Google Analytics from {start:%b %d, %Y} to {end:%b %d, %Y}</p>", unsafe_allow_html=True)
+    display_kpis(ga_windows, start, end, previous)
+
     # High-Level KPI Report
     # display_report_with_llm(
     #     lambda: create_ga_extended_summary(ga_data),
@@ -57,21 +154,12 @@ def main():
         
         Using this information, a site owner can adjust content and keywords to improve search engine rankings, tailor marketing campaigns, and better reach their target audience.
         """)
-        st.dataframe(search_data, use_container_width=True)
+        # Arrow-backed copy made once when the snapshot was loaded
+        st.dataframe(snapshot["search_display"], use_container_width=True)
     with col2:
-        response = display_report_with_llm(
-            lambda: summarize_search_queries(search_data),
-            """
-            Based on this Search Query Report from Google give tips as to possible Paid Search Strategy and SEO optimization. Try to best answer the question, 
-            What are people searching for when they come to my site and how can I get more of these users? Give me a brief analysis then 4 bullet points with 
-            concrete tips for improvement. Limit this repsonse to ~ 200 words!
-            """
-        )
-        st.write(response)
-        # Store a message to pass to the SEO helper
-        encoded_message = quote(str(response))
-        seo_url = f"https://smartmetric-seobuddy.streamlit.app?message={encoded_message}"
-        st.link_button("Check Out our SEO Helper!!", seo_url)
+        # Placeholders are filled in once the analyses come back
+        search_slot = st.empty()
+        seo_link_slot = st.empty()
 
     ### Display Acquisition Section
     st.divider()
@@ -91,16 +179,11 @@ def main():
         
         This helps refine marketing efforts to improve acquisition impact.
         """)
-        st.dataframe(summarize_acquisition_sources(ga_data)[1], use_container_width=True)
+        acquisition_summary, acquisition_table = summarize_acquisition_sources(ga_cube)
+        st.dataframe(with_previous_period(acquisition_table, ga_windows, "Session Source", previous), use_container_width=True)
     with col4:
         # Traffic/Acquisition Report
-        st.write(display_report_with_llm(
-            lambda: summarize_acquisition_sources(ga_data),
-            """
-            Analyze this acquisition report and provide insights on traffic sources and recommendations for improvement. Add insight as to how we might we might 
-            improve the site based on this data. Give me a brief analysis then 4 bullet points with concrete tips for improvement. Limit this repsonse to ~ 200 words!
-            """
-        ))
+        acquisition_slot = st.empty()
         kw_url = "https://smartmetric-keywordplanner.streamlit.app/"
         st.link_button("Check Out our Paid Search - Keyword Helper!!", kw_url)
 
@@ -123,17 +206,29 @@ def main():
         
         This helps enhance content strategy for better engagement and conversions.
         """)
-        st.dataframe(summarize_landing_pages(ga_data)[1], use_container_width=True)
+        landing_summary, landing_table = summarize_landing_pages(ga_cube)
+        st.caption(f"Top {min(len(landing_table), LANDING_PAGE_ROWS)} of {len(landing_table):,} pages by sessions")
+        landing_table = with_previous_period(landing_table.head(LANDING_PAGE_ROWS), ga_windows, "Page Path", previous)
+        st.dataframe(landing_table, use_container_width=True)
     with col6:
         # Conversion Rate Analysis
-        st.write(display_report_with_llm(
-            lambda: summarize_landing_pages(ga_data),
-            """
-            Review this conversion rate report and suggest optimizations for improving lead generation and user engagement. Keep in mind that for someone to quantify 
-            as a lead they need to go to the contacts page and fill out the form. So if landing page or source has a high conversion rate it means it ultimately led a user to the contacts page.
-            Give me a brief analysis then 4 bullet points with concrete tips for improvement. Limit this repsonse to ~ 200 words!
-            """
-        ))
+        landing_slot = st.empty()
+
+    # Fan out the three analyses, each column fills in as soon as its answer is ready
+    search_response, _, _ = display_reports_with_llm([
+        (search_slot, summarize_search_queries(search_data), SEARCH_QUERY_PROMPT),
+        (acquisition_slot, acquisition_summary, ACQUISITION_PROMPT),
+        (landing_slot, landing_summary, LANDING_PAGE_PROMPT),
+    ], context)
+
+    # Hand the analysis and the search query data to the SEO helper, only a short ID goes in the link
+    # The link is kept for reruns with the same analysis of the same snapshot (a published snapshot never changes)
+    if search_response is not None:
+        handoff_key = (snapshot["path"], search_response)
+        if st.session_state.get("seo_handoff", (None, None))[0] != handoff_key:
+            seo_url = handoff_link(SEO_HELPER_URL, {"message": search_response}, {"search_data": search_data})
+            st.session_state["seo_handoff"] = (handoff_key, seo_url)
+        seo_link_slot.link_button("Check Out our SEO Helper!!", st.session_state["seo_handoff"][1])
 
     # Initialize the conversation history in session state if not already present
     if "conversation_history" not in st.session_state:
@@ -142,13 +237,20 @@ def main():
     # Input field for the user to type a question
     user_question = st.text_input("Ask a follow-up question:")
     
-    # Process the user question if entered
-    if user_question:
-        # Generate response from GPT-4 using the stored context
-        llm_response = query_gpt(user_question)
-        
-        # Append the new question and response to the conversation history
-        st.session_state["conversation_history"].append({"question": user_question, "response": llm_response})
+    # Process the user question if entered, the input keeps its value across reruns so only new questions are sent
+    if user_question and user_question != st.session_state.get("last_question"):
+        st.session_state["last_question"] = user_question
+        # Generate response from GPT-4 using the stored context, shown as it streams in until it joins the history
+        answer_slot = st.empty()
+        try:
+            for llm_response in stream_gpt(user_question):
+                answer_slot.markdown(f"**GPT-4 Analysis:** {llm_response}{STREAMING_CURSOR}")
+        except ApiError as e:
+            answer_slot.error(f"The question could not be answered: {e}")
+        else:
+            answer_slot.empty()
+            # Append the new question and response to the conversation history
+            st.session_state["conversation_history"].append({"question": user_question, "response": llm_response})
     
     # Display the full conversation history
     st.subheader("Conversation History")
@@ -157,6 +259,22 @@ def main():
         st.markdown(f"**GPT-4 Analysis:** {entry['response']}")
         st.markdown("---")  # Divider between each message
 
+    # Cache hit/miss counters, a rerun should only add hits
+    with st.sidebar.expander("Cache stats"):
+        st.json({"data": cache.stats(), "llm": response_cache.stats()})
+
+    # Input tokens sent with each request, should stay flat as the conversation grows
+    with st.sidebar.expander("Tokens per request"):
+        st.dataframe(list(st.session_state.get("token_log", [])), use_container_width=True)
+
+    # Where the time went: per-stage latency percentiles and the most recent spans
+    if st.sidebar.checkbox("Show trace panel"):
+        st.divider()
+        st.subheader("Trace rollup")
+        st.dataframe(rollup(), use_container_width=True)
+        with st.expander("Recent spans"):
+            st.dataframe(recent_spans()[-200:][::-1], use_container_width=True)
+
 
 # Execute the main function only when the script is run directly
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+import random
+import threading
+import time
+import types
+from datetime import date, timedelta
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsResponse, DimensionHeader, DimensionValue, MetricHeader, MetricType, MetricValue, Row, RunReportResponse,
+)
+
+# In-process stand-ins for the GA4, Search Console, Google Ads and OpenAI clients
+# They generate synthetic data at a configurable scale and sleep to simulate network latency.
+# Install them with clients.override(...) so the real code paths run unchanged.
+
+_FLOAT_METRICS = {"bounceRate", "averageSessionDuration"}
+_EVENT_NAMES = ["page_view", "session_start", "scroll", "click", "generate_lead", "user_engagement"]
+_SOURCES = ["google", "(direct)", "bing", "facebook", "instagram", "yelp", "duckduckgo", "pinterest"]
+
+
+class _CallCounter:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+
+# GA4 Data API stand-in serving offset/limit paged reports, `rows` is the size of the extended report over `days` days
+# Narrower reports are capped by how many distinct combinations their dimensions have, shorter date ranges get their
+# share of the rows. A pool of distinct template rows is generated once per report shape and date range and cycled,
+# so even millions of rows can be served quickly; the values still spread over many pages, sources, days and events.
+class FakeGA4Client(_CallCounter):
+    def __init__(self, rows=10000, latency=0.2, days=365, pages=400, distinct_rows=50000, seed=0):
+        super().__init__()
+        self.rows = rows
+        self.latency = latency
+        self.days = days
+        self.pages = pages
+        self.distinct_rows = distinct_rows
+        self.seed = seed
+        self._templates = {}
+        self._templates_lock = threading.Lock()
+
+    def _dimension_value(self, name, rng, i, first_day, range_days):
+        if name == "date":
+            return (first_day + timedelta(days=i % range_days)).strftime("%Y%m%d")
+        if name == "eventName":
+            return _EVENT_NAMES[i % len(_EVENT_NAMES)]
+        if name == "sessionSource":
+            return _SOURCES[rng.randrange(len(_SOURCES))]
+        if name in ("pagePath", "landingPagePlusQueryString"):
+            return f"/page-{rng.randrange(self.pages)}"
+        if name == "firstUserCampaignName":
+            return f"campaign-{rng.randrange(6)}"
+        if name == "firstUserSourceMedium":
+            return f"{_SOURCES[rng.randrange(len(_SOURCES))]} / organic"
+        return f"{name}-{rng.randrange(50)}"
+
+    def _metric_value(self, name, rng):
+        if name in _FLOAT_METRICS:
+            return f"{rng.random():.4f}"
+        return str(rng.randrange(1, 20))
+
+    # Rows in a report: the extended report's share for the date range, capped by how many distinct combinations
+    # its dimensions have. A report filtered on one event only gets that event's share of the rows.
+    def _report_rows(self, dimensions, range_days, filtered):
+        cardinality = {
+            "date": range_days, "eventName": len(_EVENT_NAMES), "sessionSource": len(_SOURCES),
+            "pagePath": self.pages, "landingPagePlusQueryString": self.pages,
+            "firstUserCampaignName": 6, "firstUserSourceMedium": len(_SOURCES),
+        }
+        combinations = 1
+        for name in dimensions:
+            combinations *= cardinality.get(name, 50)
+        rows = min(max(self.rows * range_days // self.days, range_days), combinations)
+        return rows // len(_EVENT_NAMES) if filtered else rows
+
+    def _template_rows(self, dimensions, metrics, first_day, range_days, total):
+        key = (tuple(dimensions), tuple(metrics), first_day, range_days)
+        with self._templates_lock:
+            if key not in self._templates:
+                rng = random.Random(self.seed)
+                # Raw protobuf classes, much faster to build than the proto-plus wrappers
+                row_pb, dimension_pb, metric_pb = Row.pb(), DimensionValue.pb(), MetricValue.pb()
+                self._templates[key] = [
+                    row_pb(
+                        dimension_values=[
+                            dimension_pb(value=self._dimension_value(name, rng, i, first_day, range_days)) for name in dimensions
+                        ],
+                        metric_values=[metric_pb(value=self._metric_value(name, rng)) for name in metrics],
+                    )
+                    for i in range(max(1, min(total, self.distinct_rows)))
+                ]
+            return self._templates[key]
+
+    def _serve(self, request):
+        dimensions = [dimension.name for dimension in request.dimensions]
+        metrics = [metric.name for metric in request.metrics]
+        date_range = request.date_ranges[0]
+        first_day = date.fromisoformat(date_range.start_date)
+        range_days = min((date.fromisoformat(date_range.end_date) - first_day).days + 1, self.days)
+        total = self._report_rows(dimensions, range_days, "dimension_filter" in request)
+        templates = self._template_rows(dimensions, metrics, first_day, range_days, total)
+
+        limit = request.limit or 10000
+        end = min(request.offset + limit, total)
+        response = RunReportResponse(
+            dimension_headers=[DimensionHeader(name=name) for name in dimensions],
+            metric_headers=[
+                MetricHeader(name=name, type_=MetricType.TYPE_FLOAT if name in _FLOAT_METRICS else MetricType.TYPE_INTEGER)
+                for name in metrics
+            ],
+            row_count=total,
+        )
+        RunReportResponse.pb(response).rows.extend(templates[i % len(templates)] for i in range(request.offset, end))
+        return response
+
+    def run_report(self, request):
+        self._count()
+        time.sleep(self.latency)
+        return self._serve(request)
+
+    # All reports of a batch are served after a single round trip
+    def batch_run_reports(self, request):
+        self._count()
+        time.sleep(self.latency)
+        return BatchRunReportsResponse(reports=[self._serve(report) for report in request.requests])
+
+
+# Search Console stand-in, every request returns its share of a universe of `queries` queries
+class FakeSearchConsole(_CallCounter):
+    def __init__(self, queries=25000, latency=0.3, seed=0):
+        super().__init__()
+        self.queries = queries
+        self.latency = latency
+        self.seed = seed
+
+    def searchanalytics(self):
+        return types.SimpleNamespace(query=self._query)
+
+    def _query(self, siteUrl, body):
+        return types.SimpleNamespace(execute=lambda num_retries=0: self._execute(body))
+
+    def _execute(self, body):
+        self._count()
+        time.sleep(self.latency)
+
+        start_row = body.get("startRow", 0)
+        end_row = min(start_row + body.get("rowLimit", 1000), self.queries)
+        dimensions = body.get("dimensions", ["query"])
+        rng = random.Random(hash((self.seed, body["startDate"], start_row)))
+
+        rows = []
+        for i in range(start_row, end_row):
+            keys = []
+            for name in dimensions:
+                if name == "query":
+                    keys.append(f"dietitian query {i}")
+                elif name == "page":
+                    keys.append(f"https://example.com/page-{i % 400}")
+                elif name == "date":
+                    keys.append(body["startDate"])
+                elif name == "device":
+                    keys.append(["MOBILE", "DESKTOP", "TABLET"][i % 3])
+                else:
+                    keys.append("usa")
+            impressions = rng.randrange(1, 500)
+            clicks = rng.randrange(0, impressions // 10 + 1)
+            rows.append({
+                "keys": keys,
+                "impressions": impressions,
+                "clicks": clicks,
+                "ctr": clicks / impressions,
+                "position": 1 + rng.random() * 50,
+            })
+        return {"rows": rows} if rows else {}
+
+
+class _FakeAdsService:
+    def __init__(self, client):
+        self.client = client
+
+    def language_constant_path(self, language_id):
+        return f"languageConstants/{language_id}"
+
+    def geo_target_constant_path(self, location_id):
+        return f"geoTargetConstants/{location_id}"
+
+    # One page of ideas per call like the first page of the real pager, with results and next_page_token
+    # The token is the offset of the next page, the ideas of a seed are the same on every call
+    def generate_keyword_ideas(self, request):
+        self.client._count()
+        time.sleep(self.client.latency)
+        seed = request.url_seed.url or " ".join(request.keyword_seed.keywords)
+        rng = random.Random(seed)
+        ideas = [
+            types.SimpleNamespace(
+                text=f"keyword {rng.randrange(self.client.ideas_per_seed * 3)}",
+                keyword_idea_metrics=types.SimpleNamespace(
+                    avg_monthly_searches=rng.randrange(10, 10000),
+                    competition=types.SimpleNamespace(name=rng.choice(["LOW", "MEDIUM", "HIGH"])),
+                    low_top_of_page_bid_micros=rng.randrange(100000, 2000000),
+                    high_top_of_page_bid_micros=rng.randrange(2000000, 9000000),
+                ),
+            )
+            for _ in range(self.client.ideas_per_seed)
+        ]
+        start = int(request.page_token or 0)
+        end = min(start + (request.page_size or 1000), len(ideas))
+        return types.SimpleNamespace(results=ideas[start:end], next_page_token=str(end) if end < len(ideas) else "")
+
+
+# Google Ads client stand-in covering what the keyword planner uses
+class FakeAdsClient(_CallCounter):
+    def __init__(self, ideas_per_seed=500, latency=0.5):
+        super().__init__()
+        self.ideas_per_seed = ideas_per_seed
+        self.latency = latency
+
+    def get_type(self, name):
+        from google.ads.googleads.v18.services.types.keyword_plan_idea_service import GenerateKeywordIdeasRequest
+        return GenerateKeywordIdeasRequest()
+
+    def get_service(self, name):
+        return _FakeAdsService(self)
+
+
+# OpenAI client stand-in for chat.completions.create, with and without stream=True
+# Latency is split into time to first token plus a per-token delay
+class FakeOpenAI(_CallCounter):
+    def __init__(self, first_token_latency=0.5, token_latency=0.005, completion_tokens=250):
+        super().__init__()
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        self._count()
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        words = [f"insight{i}" for i in range(self.completion_tokens)]
+        usage = types.SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            total_tokens=prompt_tokens + self.completion_tokens,
+        )
+
+        if stream:
+            return self._stream(words, usage, kwargs.get("stream_options") or {})
+
+        time.sleep(self.first_token_latency + self.token_latency * len(words))
+        message = types.SimpleNamespace(content=" ".join(words))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+    def _stream(self, words, usage, stream_options):
+        time.sleep(self.first_token_latency)
+        for i, word in enumerate(words):
+            time.sleep(self.token_latency)
+            delta = types.SimpleNamespace(content=word if i == 0 else " " + word)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        if stream_options.get("include_usage"):
+            yield types.SimpleNamespace(choices=[], usage=usage)
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measure how long importing each module takes in a fresh interpreter
+# Imports must not build API clients or touch the network, so this also runs fine offline:
+#
+#   python benchmarks/import_time.py --repeat 5 --output import_times.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# streamlit is listed first as the baseline every app pays anyway
+MODULES = [
+    "streamlit",
+    "clients",
+    "ga4_data_pull",
+    "ga4_store",
+    "gsc_data_pull",
+    "gaw_data_pull",
+    "llm_integration",
+]
+
+_SNIPPET = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def time_import(module, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", _SNIPPET.format(module=module)],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return {"module": module, "median_s": statistics.median(timings), "min_s": min(timings), "runs": repeat}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time module imports in fresh interpreters")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [time_import(module, args.repeat) for module in args.modules]
+    for result in results:
+        print(f"{result['module']:<20} median {result['median_s'] * 1000:8.1f} ms   min {result['min_s'] * 1000:8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
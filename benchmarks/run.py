@@ -0,0 +1,303 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Offline benchmark of the dashboard pipeline
+# Every external API is replaced by an in-process stand-in from fakes.py, so no credentials or network are needed:
+#
+#   python benchmarks/run.py --ga4-rows 10000,100000,1000000 --gsc-queries 25000
+#   python benchmarks/run.py --compare benchmarks/results/<older commit>.json
+#
+# Results are written as JSON to benchmarks/results/<commit>.json so runs can be compared across commits.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Run fn `repeat` times, calling setup() untimed before each run, and return timing stats
+# warmup runs fn once untimed first, e.g. so a stand-in can generate its synthetic data
+def _time(fn, repeat, setup=None, warmup=False):
+    timings = []
+    result = None
+    if warmup:
+        fn()
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "runs": repeat}, result
+
+
+# Installs the stand-in clients in a pipeline worker process, the workers start fresh and do not inherit overrides
+def _install_fakes(ga4_rows, gsc_queries, latency):
+    import clients
+    from fakes import FakeGA4Client, FakeOpenAI, FakeSearchConsole
+    clients.override("ga4", FakeGA4Client(rows=ga4_rows, latency=0.2 * latency))
+    clients.override("search_console", FakeSearchConsole(queries=gsc_queries, latency=0.3 * latency))
+    clients.override("openai", FakeOpenAI(first_token_latency=0.5 * latency, token_latency=0.005 * latency))
+
+
+def _record(results, stage, scale, stats):
+    results.append({"stage": stage, "scale": scale, **stats})
+    line = f"{stage:<28} {str(scale):>10}   median {stats['median_s'] * 1000:10.1f} ms   min {stats['min_s'] * 1000:10.1f} ms"
+    if "bytes_after" in stats:
+        line += f"   memory {stats['bytes_before'] / 2**20:.1f} MB -> {stats['bytes_after'] / 2**20:.1f} MB"
+    print(line)
+
+
+def run(args, workdir):
+    # Point every on-disk store at a scratch directory before the modules read their settings
+    os.environ["GA4_STORE_DIR"] = os.path.join(workdir, "ga4")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite3")
+    os.environ["CRAWL_CACHE_DIR"] = os.path.join(workdir, "crawl_cache")
+    os.environ["TRACE_LOG_PATH"] = os.path.join(workdir, "traces.jsonl")
+    os.environ["SNAPSHOT_DIR"] = os.path.join(workdir, "snapshots")
+    os.environ["HANDOFF_PATH"] = os.path.join(workdir, "handoff.sqlite3")
+    os.environ["GA4_PROPERTY_ID"] = "benchmark"
+
+    import streamlit as st
+    # Outside `streamlit run` session state is not kept, a plain dict stands in for it
+    st.session_state = {}
+
+    import clients
+    from fakes import FakeAdsClient, FakeGA4Client, FakeOpenAI, FakeSearchConsole
+    import ga4_data_pull
+    import gaw_data_pull
+    import gsc_data_pull
+    import llm_integration
+    from data_cache import cache
+    from frame_memory import compact_frame, memory_report
+    from ga4_cube import build_cube, build_cube_from_reports, build_prefix_sums, window_cube
+    from llm_cache import response_cache
+
+    latency = args.latency
+    results = []
+
+    # GA4: RPC, parsing, cube build and summaries at each scale
+    for rows in args.ga4_rows:
+        ga4 = FakeGA4Client(rows=rows, latency=0.2 * latency)
+        clients.override("ga4", ga4)
+        stats, responses = _time(
+            lambda: list(ga4_data_pull._iter_report_pages(
+                lambda offset: ga4_data_pull._build_extended_request("benchmark", "2024-01-01", "2024-12-31", offset=offset)
+            )), args.repeat, warmup=True
+        )
+        _record(results, "ga4_rpc", rows, stats)
+
+        stats, df = _time(
+            lambda: ga4_data_pull._concat_frames([ga4_data_pull._add_leads(ga4_data_pull._response_to_frame(r)) for r in responses]),
+            args.repeat,
+        )
+        _record(results, "ga4_parse", rows, stats)
+
+        # Compact representation, the memory before and after is kept with the timings
+        stats, compact = _time(lambda: compact_frame(df), args.repeat)
+        stats["bytes_before"] = int(df.memory_usage(deep=True).sum())
+        stats["bytes_after"] = int(compact.memory_usage(deep=True).sum())
+        report = memory_report(df, compact)
+        stats["columns"] = report.to_dict("records")
+        _record(results, "ga4_compact", rows, stats)
+        print(report.to_string(index=False))
+
+        stats, _ = _time(lambda: ga4_data_pull.fetch_ga4_extended_data("2024-01-01", "2024-12-31", property_id="benchmark"), args.repeat)
+        _record(results, "ga4_fetch_total", rows, stats)
+
+        stats, cube = _time(lambda: build_cube(df), args.repeat)
+        _record(results, "ga4_cube_build", rows, stats)
+
+        # The narrow reports the summaries actually need, fetched concurrently, and the cube built from them
+        plan = ga4_data_pull.plan_reports()
+        stats, frames = _time(
+            lambda: ga4_data_pull.fetch_ga4_reports(plan, "2024-01-01", "2024-12-31", property_id="benchmark"),
+            args.repeat, warmup=True,
+        )
+        _record(results, "ga4_narrow_fetch", rows, stats)
+
+        stats, narrow_cube = _time(lambda: build_cube_from_reports(plan, frames), args.repeat)
+        _record(results, "ga4_narrow_cube_build", rows, stats)
+
+        # Running daily totals, then a 30 day window with its previous period as the date range control asks for it
+        stats, windows = _time(lambda: build_prefix_sums(narrow_cube), args.repeat)
+        _record(results, "ga4_prefix_sums", rows, stats)
+
+        stats, _ = _time(
+            lambda: [window_cube(windows, *period) for period in (("2024-12-01", "2024-12-30"), ("2024-11-01", "2024-11-30"))],
+            args.repeat,
+        )
+        _record(results, "ga4_window_compare", rows, stats)
+
+        stats, _ = _time(lambda: ga4_data_pull.summarize_acquisition_sources(cube), args.repeat)
+        _record(results, "summarize_acquisition", rows, stats)
+
+        stats, _ = _time(lambda: ga4_data_pull.summarize_landing_pages(cube), args.repeat)
+        _record(results, "summarize_landing_pages", rows, stats)
+
+    # Search Console: full fetch with paging and shards, then the summary
+    clients.override("search_console", FakeSearchConsole(queries=args.gsc_queries, latency=0.3 * latency))
+    stats, search_data = _time(
+        lambda: gsc_data_pull.fetch_search_console_data("2024-01-01", "2024-12-31"), args.repeat,
+        setup=lambda: cache.invalidate("gsc"),
+    )
+    _record(results, "gsc_fetch", args.gsc_queries, stats)
+
+    stats, search_summary = _time(lambda: gsc_data_pull.summarize_search_queries(search_data), args.repeat)
+    _record(results, "summarize_search_queries", args.gsc_queries, stats)
+
+    # Keyword Planner: ideas for a few seeds, two pages each under the Ads rate limit, every run without cached seeds
+    clients.override("google_ads", FakeAdsClient(ideas_per_seed=gaw_data_pull.PAGE_SIZE + 500, latency=0.5 * latency))
+    seeds = ["dietitian near me", "https://example.com/", "nutrition counseling"]
+    stats, _ = _time(
+        lambda: gaw_data_pull.fetch_keyword_ideas("benchmark", seeds, [2840], 1000), args.repeat,
+        setup=lambda: cache.invalidate("gaw"),
+    )
+    _record(results, "keyword_ideas_fetch", len(seeds), stats)
+
+    # LLM: a cold request goes to the stand-in API, a warm one is answered from the response cache
+    clients.override("openai", FakeOpenAI(first_token_latency=0.5 * latency, token_latency=0.005 * latency))
+    llm_integration.initialize_llm_context()
+    stats, _ = _time(
+        lambda: llm_integration.query_gpt("Benchmark question", search_summary, context=llm_integration.business_context),
+        args.repeat, setup=response_cache.clear,
+    )
+    _record(results, "query_gpt_cold", 1, stats)
+
+    stats, _ = _time(
+        lambda: llm_integration.query_gpt("Benchmark question", search_summary, context=llm_integration.business_context),
+        args.repeat,
+    )
+    _record(results, "query_gpt_warm", 1, stats)
+
+    # Streamed answer: the whole answer, and how long until its first text could be shown
+    first_text_s = []
+
+    def stream_cold():
+        start = time.perf_counter()
+        for i, _ in enumerate(llm_integration.stream_gpt("Benchmark question", search_summary, context=llm_integration.business_context)):
+            if i == 0:
+                first_text_s.append(time.perf_counter() - start)
+
+    stats, _ = _time(stream_cold, args.repeat, setup=response_cache.clear)
+    _record(results, "stream_gpt_cold", 1, stats)
+    _record(results, "stream_gpt_first_text", 1, {"median_s": statistics.median(first_text_s), "min_s": min(first_text_s), "runs": len(first_text_s)})
+
+    # Headless pipeline over many properties on the process pool, every run starts without stores or cached answers
+    import pipeline
+    configs = [
+        {"name": f"property-{i}", "property_id": f"benchmark-{i}", "site_url": f"https://example-{i}.com/"}
+        for i in range(args.properties)
+    ]
+
+    def pipeline_setup():
+        shutil.rmtree(os.environ["GA4_STORE_DIR"], ignore_errors=True)
+        response_cache.clear()
+
+    stats, records = _time(
+        lambda: pipeline.run_pipeline(
+            configs, "2024-01-01", "2024-12-31", output_dir=os.path.join(workdir, "tenants"),
+            worker_setup=functools.partial(_install_fakes, args.ga4_rows[0], args.gsc_queries, latency),
+        ),
+        args.repeat, setup=pipeline_setup,
+    )
+    failed = [record for record in records if record["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"Pipeline failed for {len(failed)} properties: {failed[0]['error']}")
+    _record(results, "pipeline_properties", args.properties, stats)
+
+    # Full dashboard render at the largest GA4 scale: cold (no stores, no snapshot, no caches) builds the snapshot,
+    # a page load in a fresh session reads the published snapshot, and a rerun straight after
+    rows = args.ga4_rows[-1]
+
+    def cold_setup():
+        cache.invalidate()
+        response_cache.clear()
+        shutil.rmtree(os.environ["GA4_STORE_DIR"], ignore_errors=True)
+        shutil.rmtree(os.environ["SNAPSHOT_DIR"], ignore_errors=True)
+        st.session_state.clear()
+
+    def page_load_setup():
+        cache.invalidate()
+        response_cache.clear()
+        st.session_state.clear()
+
+    import app
+    stats, _ = _time(app.main, args.repeat, setup=cold_setup)
+    _record(results, "app_render_cold", rows, stats)
+
+    stats, _ = _time(app.main, args.repeat, setup=page_load_setup)
+    _record(results, "app_render_snapshot", rows, stats)
+
+    stats, _ = _time(app.main, args.repeat)
+    _record(results, "app_rerun", rows, stats)
+
+    return results
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["stage"], r["scale"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["stage"], result["scale"]))
+        if before and before["median_s"] > 0:
+            ratio = result["median_s"] / before["median_s"]
+            print(f"{result['stage']:<28} {str(result['scale']):>10}   {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the dashboard pipeline")
+    parser.add_argument("--ga4-rows", default="10000,100000", help="Comma separated GA4 report sizes")
+    parser.add_argument("--gsc-queries", type=int, default=25000)
+    parser.add_argument("--properties", type=int, default=8, help="Properties in the multi-property pipeline run")
+    parser.add_argument("--latency", type=float, default=1.0, help="Scale factor for the simulated API latencies, 0 disables them")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+    args.ga4_rows = [int(rows) for rows in args.ga4_rows.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="ga-connection-bench-")
+    try:
+        results = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = _git_commit()
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "latency_scale": args.latency,
+            "results": results,
+        }, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import threading
+import streamlit as st
+
+# Process-wide registry of API clients
+# Nothing is imported, authenticated or fetched until a client is first asked for, after that the same
+# instance is reused for the life of the process (or of the thread, for clients that are not thread-safe)
+
+_factories = {}
+_clients = {}
+_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+# Register how to build a client, per_thread clients get one instance per thread
+def register(name, factory, per_thread=False):
+    _factories[name] = (factory, per_thread)
+
+
+def get_client(name):
+    factory, per_thread = _factories[name]
+
+    if per_thread:
+        clients = _thread_local.__dict__.setdefault("clients", {})
+        if name not in clients:
+            clients[name] = _clients[name] if name in _clients else factory()
+        return clients[name]
+
+    if name not in _clients:
+        with _lock:
+            if name not in _clients:
+                _clients[name] = factory()
+    return _clients[name]
+
+
+# Use a ready-made client instead of building one, e.g. a stand-in for benchmarks
+def override(name, client):
+    with _lock:
+        _clients[name] = client
+    _thread_local.__dict__.get("clients", {}).pop(name, None)
+
+
+# Forget built clients so the next get_client builds them again
+def reset(name=None):
+    with _lock:
+        if name is None:
+            _clients.clear()
+        else:
+            _clients.pop(name, None)
+    if name is None:
+        _thread_local.__dict__.get("clients", {}).clear()
+    else:
+        _thread_local.__dict__.get("clients", {}).pop(name, None)
+
+
+def _ga4_client():
+    from google.analytics.data_v1beta import BetaAnalyticsDataClient
+    return BetaAnalyticsDataClient.from_service_account_info(st.secrets["google_service_account"])
+
+
+# Built from the discovery document bundled with google-api-python-client, so no discovery request goes out
+def _search_console_client():
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    credentials = service_account.Credentials.from_service_account_info(
+        st.secrets["google_service_account"],
+        scopes=['https://www.googleapis.com/auth/webmasters.readonly']
+    )
+    return build_from_document(get_static_doc('searchconsole', 'v1'), credentials=credentials)
+
+
+# Retries are left to the shared scheduler in rate_limit, which also paces the other workers after a 429
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["openai"]["api_key"], max_retries=0)
+
+
+def _google_ads_client():
+    from google.ads.googleads.client import GoogleAdsClient
+    credentials_dict = {
+        "developer_token": st.secrets["google_ads"]["developer_token"],
+        "client_id": st.secrets["google_ads"]["client_id"],
+        "client_secret": st.secrets["google_ads"]["client_secret"],
+        "refresh_token": st.secrets["google_ads"]["refresh_token"],
+        "login_customer_id": None,  # Optional for test accounts
+        "use_proto_plus": True
+    }
+    return GoogleAdsClient.load_from_dict(credentials_dict, version="v18")
+
+
+# Pooled HTTP session for scraping, sized for the crawler's concurrency
+def _http_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "Mozilla/5.0 (compatible; SEOHelper/1.0)"
+    return session
+
+
+register("ga4", _ga4_client)
+register("openai", _openai_client)
+register("google_ads", _google_ads_client)
+register("http", _http_session)
+
+# httplib2 connections are not thread-safe, so every thread gets its own Search Console service
+register("search_console", _search_console_client, per_thread=True)
@@ -0,0 +1,29 @@
+import json
+import os
+from datetime import date, datetime
+
+# Small helpers shared by the stores and the batch entry points
+
+
+# A date from a date, a datetime or a "YYYY-MM-DD" string
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+# Write a file through a temporary name so readers never see it half written, write(tmp_path) writes the content
+# The temporary name is per process, so processes writing the same file do not trip over each other
+def replace_file(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2, default=str)
+    replace_file(path, write)
@@ -0,0 +1,51 @@
+from ga4_data_pull import summarize_acquisition_sources, summarize_landing_pages
+from gsc_data_pull import fetch_search_console_data, summarize_search_queries
+from llm_integration import (
+    complete_batch, date_range_context, SEARCH_QUERY_PROMPT, ACQUISITION_PROMPT, LANDING_PAGE_PROMPT,
+)
+from tracing import TracedThreadPoolExecutor
+
+# The dashboard built outside the app: fetch GA4 and Search Console, summarize them and analyse the summaries
+# Shared by the headless pipeline (pipeline.py) and the precompute worker (precompute_worker.py)
+
+
+# Fetch a property's GA4 data and its Search Console data, returns (GA4 data, search data)
+# load_ga4() returns the GA4 data, search_args go to fetch_search_console_data. Without a site URL the search data is None
+def fetch_sources(load_ga4, site_url, *search_args):
+    # GA4 and Search Console are independent, fetch them side by side
+    with TracedThreadPoolExecutor(max_workers=2) as pool:
+        ga4_future = pool.submit(load_ga4)
+        search_future = pool.submit(fetch_search_console_data, *search_args, site_url=site_url) if site_url else None
+        return ga4_future.result(), search_future.result() if search_future else None
+
+
+# The dashboard analyses of a cube (and of the search data, when there is any)
+# Returns ({name: (prompt, data summary)}, {name: table the summary was made from})
+def analysis_jobs(cube, search_data=None):
+    acquisition_summary, acquisition_table = summarize_acquisition_sources(cube)
+    landing_summary, landing_table = summarize_landing_pages(cube)
+    jobs = {
+        "acquisition": (ACQUISITION_PROMPT, acquisition_summary),
+        "landing_pages": (LANDING_PAGE_PROMPT, landing_summary),
+    }
+    tables = {"acquisition": acquisition_table, "landing_pages": landing_table}
+    if search_data is not None:
+        jobs["search_queries"] = (SEARCH_QUERY_PROMPT, summarize_search_queries(search_data))
+        tables["search_queries"] = search_data
+    return jobs, tables
+
+
+# Analyse one date range, all of its prompts sent to the LLM in one batch
+# Returns {"jobs", "tables", "context": the LLM context used, "analyses": {name: answer}, "errors": {name: text}},
+# an analysis the API could not produce is None with its error listed under "errors"
+def analyse_range(cube, search_data, start, end, business_context=None):
+    jobs, tables = analysis_jobs(cube, search_data)
+    context = date_range_context(start, end, business_context)
+    results = dict(zip(jobs, complete_batch(list(jobs.values()), context)))
+    return {
+        "jobs": jobs,
+        "tables": tables,
+        "context": context,
+        "analyses": {name: answer for name, (answer, _) in results.items()},
+        "errors": {name: str(error) for name, (_, error) in results.items() if error is not None},
+    }
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import pandas as pd
+
+# How long a cached pull stays valid, in seconds
+DEFAULT_TTL_SECONDS = int(os.environ.get("DATA_CACHE_TTL_SECONDS", 3600))
+
+# Upper bound on the memory held by cached results, least recently used entries are evicted first
+DEFAULT_MAX_BYTES = int(os.environ.get("DATA_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+# Rough in-memory size of a cached value
+def _size_of(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size_of(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+# Turn argument values into something hashable so they can be part of a cache key
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+# Process-wide TTL + LRU cache for data pulls
+# Lives at module level so it survives Streamlit reruns, keys are tuples starting with the source name
+class DataCache:
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {}
+
+    def _count(self, source, field):
+        counts = self._stats.setdefault(source, {"hits": 0, "misses": 0, "evictions": 0})
+        counts[field] += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    # Return (True, value) on a live hit and (False, None) otherwise
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self._count(key[0], "misses")
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._count(key[0], "hits")
+            return True, entry[0]
+
+    def set(self, key, value, ttl=None):
+        size = _size_of(value)
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            # A single value larger than the whole budget is never stored
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._count(oldest[0], "evictions")
+
+    # Drop every entry for a source, or everything when no source is given
+    def invalidate(self, source=None):
+        with self._lock:
+            for key in [key for key in self._entries if source is None or key[0] == source]:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "sources": {source: dict(counts) for source, counts in self._stats.items()},
+            }
+
+
+# Shared instance used by all the data pull modules
+cache = DataCache()
+
+
+# Decorator caching a data pull in the shared cache
+# key(*args, **kwargs) returns the parts identifying the pull (property, date range, dimensions ...),
+# by default the call arguments are used. cache_if(result) can veto storing a result, e.g. an error.
+def cached(source, key=None, ttl=None, cache_if=None):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            cache_key = (source,) + _freeze(tuple(parts))
+
+            hit, value = cache.get(cache_key)
+            if hit:
+                return value
+
+            value = func(*args, **kwargs)
+            if cache_if is None or cache_if(value):
+                cache.set(cache_key, value, ttl=ttl)
+            return value
+
+        wrapper.invalidate = lambda: cache.invalidate(source)
+        return wrapper
+    return decorator
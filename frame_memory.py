@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from tracing import span
+
+# Compact in-memory representation for large report frames
+# Dimensions are dictionary encoded (categoricals), metrics downcast to int32/float32
+# and dates optionally stored as int32 day numbers. Frames meant for display can be Arrow-backed, which
+# Streamlit hands to the browser without converting column by column.
+
+# String columns with at most this share of distinct values are dictionary encoded
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+_INT32 = np.iinfo(np.int32)
+
+
+def _compact_column(values, date_key):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if date_key and values.dt.tz is None:
+            # Days since 1970-01-01, half the size of a timestamp
+            return pd.Series((values.to_numpy().astype("datetime64[D]") - _EPOCH).astype(np.int32), index=values.index)
+        return values
+    if pd.api.types.is_bool_dtype(values):
+        return values
+    # Fixed widths rather than the smallest type per frame, so frames written at different times share a schema
+    if pd.api.types.is_integer_dtype(values):
+        if len(values) and (values.min() < _INT32.min or values.max() > _INT32.max):
+            return values
+        return values.astype(np.int32)
+    if pd.api.types.is_float_dtype(values):
+        return values.astype(np.float32)
+    if values.dtype == object and len(values) and values.nunique(dropna=False) <= CATEGORY_MAX_UNIQUE_RATIO * len(values):
+        return values.astype("category")
+    return values
+
+
+# Return a compacted copy of df, the input frame is never modified
+# date_key stores datetime columns as int32 day numbers (see restore_dates), arrow converts every column to an
+# Arrow-backed dtype (categoricals become Arrow dictionaries). Aggregations over downcast metrics should cast
+# back to int64/float64 first so sums cannot overflow.
+def compact_frame(df, date_key=False, arrow=False):
+    with span("frame.compact", rows=len(df)) as current:
+        compact = pd.DataFrame({name: _compact_column(df[name], date_key) for name in df.columns}, index=df.index)
+        if arrow:
+            import pyarrow as pa
+            compact = pa.Table.from_pandas(compact, preserve_index=False).to_pandas(types_mapper=pd.ArrowDtype)
+            compact.index = df.index
+        current.set(
+            bytes_before=int(df.memory_usage(deep=True).sum()),
+            bytes=int(compact.memory_usage(deep=True).sum()),
+        )
+        return compact
+
+
+# Turn int32 day number columns written by compact_frame(date_key=True) back into datetimes
+def restore_dates(df, columns=("Date",)):
+    for name in columns:
+        if name in df.columns and pd.api.types.is_integer_dtype(df[name]):
+            df[name] = df[name].to_numpy().astype("datetime64[D]").astype("datetime64[ns]")
+    return df
+
+
+# Memory used by every column before and after compacting, largest savings first
+def memory_report(before, after=None):
+    after = compact_frame(before) if after is None else after
+    bytes_before = before.memory_usage(deep=True, index=False)
+    bytes_after = after.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "Column": before.columns,
+        "Dtype Before": [str(before[name].dtype) for name in before.columns],
+        "Bytes Before": bytes_before[before.columns].to_numpy(),
+        "Dtype After": [str(after[name].dtype) for name in before.columns],
+        "Bytes After": bytes_after[before.columns].to_numpy(),
+    })
+    report["Saved (%)"] = (100 * (1 - report["Bytes After"] / report["Bytes Before"].where(report["Bytes Before"] > 0))).round(1)
+    return report.sort_values(by="Bytes Before", ascending=False, ignore_index=True)
@@ -0,0 +1,185 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+# Dimensions the dashboard summaries slice by
+CUBE_DIMENSIONS = ["Date", "Session Source", "Page Path", "Campaign Name"]
+
+# Additive measures kept in the cube, bounce rate is stored as a session-weighted sum so it can be re-averaged
+CUBE_METRICS = ["Sessions", "Leads", "Event Count", "Bounce Weighted"]
+
+# Raw GA4 columns needed to build the cube
+SOURCE_COLUMNS = CUBE_DIMENSIONS + ["Sessions", "Bounce Rate", "Leads", "Event Count"]
+
+
+# Build the aggregation cube once per data refresh
+# One groupby over the raw rows gives the base cube, every rollup after that works on the (much smaller) base.
+# cube["daily"][dim] is indexed by (Date, dim), cube["totals"][dim] by dim alone. The input frame is never modified.
+def build_cube(df):
+    if not all(col in df.columns for col in SOURCE_COLUMNS):
+        raise ValueError("Data does not contain required columns.")
+
+    # Metrics may be stored downcast (see frame_memory), sums are taken at full width so they cannot overflow
+    sessions = df["Sessions"].to_numpy(dtype="int64")
+    measures = pd.DataFrame({
+        **{dim: df[dim] for dim in CUBE_DIMENSIONS},
+        "Sessions": sessions,
+        "Leads": df["Leads"].to_numpy(dtype="float64"),
+        "Event Count": df["Event Count"].to_numpy(dtype="int64"),
+        "Bounce Weighted": df["Bounce Rate"].to_numpy(dtype="float64") * sessions,
+    }, index=df.index)
+    base = measures.groupby(CUBE_DIMENSIONS, observed=True, sort=False)[CUBE_METRICS].sum()
+
+    daily = {"Date": base.groupby(level="Date").sum()}
+    for dim in CUBE_DIMENSIONS[1:]:
+        daily[dim] = base.groupby(level=["Date", dim], observed=True).sum()
+
+    totals = {"Date": daily["Date"]}
+    for dim in CUBE_DIMENSIONS[1:]:
+        totals[dim] = daily[dim].groupby(level=dim, observed=True).sum()
+
+    return {"daily": daily, "totals": totals}
+
+
+# Turn per-group totals into the summary table shown on the dashboard
+def summarize_totals(totals, dimension):
+    sessions = totals["Sessions"]
+    summary = pd.DataFrame({
+        dimension: totals.index.astype(object),
+        "Sessions": sessions.to_numpy(),
+        "Bounce_Rate": (totals["Bounce Weighted"] / sessions.where(sessions > 0)).fillna(0).to_numpy(),
+        "Conversions": totals["Leads"].to_numpy(),
+    })
+
+    # Calculate Conversion Rate
+    summary["Conversion Rate (%)"] = (summary["Conversions"] / summary["Sessions"] * 100).round(2)
+
+    # Sort by Sessions in descending order
+    return summary.sort_values(by="Sessions", ascending=False, ignore_index=True)
+
+
+# Cube measures of one narrow report, indexed by its dimensions
+def _report_measures(df, dimensions, metrics):
+    index = pd.MultiIndex.from_arrays(
+        [df[dim] if dim == "Date" else df[dim].astype(object) for dim in dimensions], names=dimensions
+    ) if len(dimensions) > 1 else pd.Index(df[dimensions[0]], name=dimensions[0])
+
+    columns = {}
+    if "Sessions" in metrics:
+        sessions = df["Sessions"].to_numpy(dtype="int64")
+        columns["Sessions"] = sessions
+        columns["Event Count"] = df["Event Count"].to_numpy(dtype="int64")
+        columns["Bounce Weighted"] = df["Bounce Rate"].to_numpy(dtype="float64") * sessions
+    if "Leads" in metrics:
+        columns["Leads"] = df["Leads"].to_numpy(dtype="float64")
+    return pd.DataFrame(columns, index=index).groupby(level=dimensions).sum()
+
+
+# Build the same cube from the narrow reports of ga4_data_pull.plan_reports
+# Sessions come from the (Date, dim) report of each dimension, leads are rolled up from the filtered lead report
+def build_cube_from_reports(plan, frames):
+    sessions = {}
+    leads = None
+    for name, report in plan.items():
+        measures = _report_measures(frames[name], report["dimensions"], report["metrics"])
+        if report.get("event_name"):
+            leads = measures
+        else:
+            dim = report["dimensions"][-1]
+            sessions[dim] = measures
+
+    daily = {}
+    for dim, measures in sessions.items():
+        levels = ["Date"] if dim == "Date" else ["Date", dim]
+        dim_leads = leads["Leads"].groupby(level=levels).sum() if leads is not None else pd.Series(dtype="float64")
+        # Days a dimension value had leads are kept even when the sessions report has no row for them
+        cube = measures.join(dim_leads.rename("Leads"), how="outer").fillna(0)
+        cube = cube.astype({"Sessions": "int64", "Event Count": "int64"})
+        daily[dim] = cube[CUBE_METRICS]
+
+    totals = {"Date": daily["Date"]}
+    for dim in daily:
+        if dim != "Date":
+            totals[dim] = daily[dim].groupby(level=dim).sum()
+
+    return {"daily": daily, "totals": totals}
+
+
+# Running totals over the days of a cube, so the totals of any date window cost O(values log days)
+# Only the days a value occurs on are stored, so memory grows with the cube's rows rather than days x values.
+# For every dimension sums[dim] holds
+#   keys: value code * (days + 1) + day number of every (day, value) row of the cube, sorted
+#   cum:  (rows + 1, metrics) running totals over the rows in key order, with a leading zero row
+# so the totals of value v over days [i, j) are cum[searchsorted(keys, v * (days + 1) + j)] minus the same at i.
+# "Date" has a single value ("All") holding the overall totals.
+def build_prefix_sums(cube):
+    dates = cube["daily"]["Date"].index
+    days = pd.date_range(dates.min(), dates.max(), freq="D", name="Date")
+    stride = len(days) + 1
+
+    sums, labels = {}, {}
+    for dim, daily in cube["daily"].items():
+        if dim == "Date":
+            day_numbers = (daily.index - days[0]).days.to_numpy()
+            codes = np.zeros(len(daily), dtype="int64")
+            labels[dim] = pd.Index(["All"], name=dim)
+        else:
+            day_numbers = (daily.index.get_level_values("Date") - days[0]).days.to_numpy()
+            codes, uniques = pd.factorize(daily.index.get_level_values(dim), sort=True)
+            labels[dim] = pd.Index(uniques, dtype=object, name=dim)
+
+        keys = codes.astype("int64") * stride + day_numbers
+        order = np.argsort(keys, kind="stable")
+        cumulative = np.zeros((len(keys) + 1, len(CUBE_METRICS)))
+        np.cumsum(daily[CUBE_METRICS].to_numpy(dtype="float64")[order], axis=0, out=cumulative[1:])
+        sums[dim] = {"keys": keys[order], "cum": cumulative}
+
+    return {"days": days, "labels": labels, "sums": sums}
+
+
+def _window_values(prefix, dimension, start, end):
+    days = prefix["days"]
+    first = days.searchsorted(pd.Timestamp(start))
+    last = max(days.searchsorted(pd.Timestamp(end), side="right"), first)
+    sums = prefix["sums"][dimension]
+    base = np.arange(len(prefix["labels"][dimension]), dtype="int64") * (len(days) + 1)
+    return sums["cum"][np.searchsorted(sums["keys"], base + last)] - sums["cum"][np.searchsorted(sums["keys"], base + first)]
+
+
+# Per-value totals of one dimension over the days start..end (inclusive), in the layout of cube["totals"][dimension]
+# Values without sessions or leads in the window are left out
+def window_totals(prefix, dimension, start, end):
+    totals = pd.DataFrame(_window_values(prefix, dimension, start, end), index=prefix["labels"][dimension], columns=CUBE_METRICS)
+    totals = totals.round(6)
+    totals = totals[(totals["Sessions"] > 0) | (totals["Leads"] > 0)]
+    return totals.astype({"Sessions": "int64", "Event Count": "int64"})
+
+
+# Overall totals over the days start..end (inclusive), a Series of the cube metrics
+def window_overall(prefix, start, end):
+    return pd.Series(_window_values(prefix, "Date", start, end)[0], index=CUBE_METRICS)
+
+
+# The last `length` days of a prefix sum structure as (start, end) dates, all of its days when length is None
+def last_days(prefix, length=None):
+    first_day, last_day = prefix["days"][0].date(), prefix["days"][-1].date()
+    if length is None:
+        return first_day, last_day
+    return max(first_day, last_day - timedelta(days=length - 1)), last_day
+
+
+# Cube-like totals for a date window, the summarize functions read it like a full cube
+def window_cube(prefix, start, end):
+    return {"totals": {dim: window_totals(prefix, dim, start, end) for dim in prefix["sums"] if dim != "Date"}}
+
+
+# Add the previous period's sessions and conversions, and the change in sessions, to a summary table
+def compare_summaries(current, previous, dimension):
+    previous = previous.set_index(dimension)
+    comparison = current.copy()
+    comparison["Previous Sessions"] = comparison[dimension].map(previous["Sessions"]).fillna(0).astype("int64")
+    comparison["Sessions Change (%)"] = (
+        (comparison["Sessions"] / comparison["Previous Sessions"].where(comparison["Previous Sessions"] > 0) - 1) * 100
+    ).round(1)
+    comparison["Previous Conversions"] = comparison[dimension].map(previous["Conversions"]).fillna(0)
+    return comparison
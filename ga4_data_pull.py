@@ -1,22 +1,37 @@
+import os
+from collections import deque
+import numpy as np
 import pandas as pd
 from datetime import date
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import RunReportRequest, DateRange, Dimension, Metric
+from google.analytics.data_v1beta.types import (
+    RunReportRequest, BatchRunReportsRequest, DateRange, Dimension, Metric, MetricType, Filter, FilterExpression,
+)
 import streamlit as st
+from summary_render import SUMMARY_TOKEN_BUDGET, render_table
+from ga4_cube import build_cube, summarize_totals
+from frame_memory import compact_frame
+from clients import get_client
+from tracing import TracedThreadPoolExecutor, span, traced
+from rate_limit import call
 
-# Load the secrets for the service account path and property ID
-service_account_info = st.secrets["google_service_account"]
-property_id = st.secrets["google_service_account"]["property_id"]
-
-# Initialize GA Client using the service account JSON
-client = BetaAnalyticsDataClient.from_service_account_info(service_account_info)
+# The GA client is built on first use by the client registry
+# Property ID from the GA4_PROPERTY_ID environment variable or the service account secrets,
+# read when a report is first requested
+def default_property_id():
+    return os.environ.get("GA4_PROPERTY_ID") or st.secrets["google_service_account"]["property_id"]
 
 # Get todays date
 today = date.today().strftime("%Y-%m-%d")
 
-# Function to fetch GA4 data with search queries, page path, and conversion data
-def fetch_ga4_extended_data():
-    request = RunReportRequest(
+# GA4 returns at most 250,000 rows per request, larger reports have to be paged with offset
+PAGE_SIZE = 250000
+
+# Number of offset pages fetched at the same time once the total row count is known
+MAX_WORKERS = 4
+
+# Build the extended report request for a single page of rows
+def _build_extended_request(property_id, start_date, end_date, offset=0):
+    return RunReportRequest(
         property=f"properties/{property_id}",
         dimensions=[
             Dimension(name="date"),                     # Break down by date
@@ -35,128 +50,323 @@ def fetch_ga4_extended_data():
             Metric(name="newUsers"),                   # New users
             Metric(name="eventCount")
         ],
-        date_ranges=[DateRange(start_date="2024-01-01", end_date=today)],  # Define the date range
+        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],  # Define the date range
+        limit=PAGE_SIZE,
+        offset=offset,
     )
-    
-    response = client.run_report(request)
-    
-    # Parse the response and create a DataFrame
-    rows = []
-    for row in response.rows:
-        # Extract dimension and metric values
-        date = row.dimension_values[0].value
-        page_path = row.dimension_values[1].value
-        session_source = row.dimension_values[2].value
-        campaign_name = row.dimension_values[3].value
-        source_medium = row.dimension_values[4].value
-        lp_query = row.dimension_values[5].value
-        event_name = row.dimension_values[6].value
-            
-        sessions = row.metric_values[0].value
-        pageviews = row.metric_values[1].value
-        bounce_rate = row.metric_values[2].value
-        avg_session_duration = row.metric_values[3].value
-        new_users = row.metric_values[4].value
-        event_count = row.metric_values[5].value
-        
-        # Append the data to the list
-        rows.append([
-            date, page_path, session_source, campaign_name, source_medium, lp_query, event_name,
-            sessions, pageviews, bounce_rate, avg_session_duration, new_users, event_count
-        ])
-    
-    # Create DataFrame from the list of rows
-    df = pd.DataFrame(rows, columns=[
-        'Date', 'Page Path', 'Session Source', 'Campaign Name', 'Source/Medium', "Lp/Query", 'Event Name', 
-        'Sessions', 'Pageviews', 'Bounce Rate', 'Avg. Session Duration', 'New Users', 'Event Count'
-    ])
-    
-    # Process date columns for easier handling
-    df['Date'] = pd.to_datetime(df['Date'])
-    df.sort_values(by='Date', inplace=True)
 
-    # Filter rows where Event Name is "generate_lead" and create a new 'Leads' column
-    df['Leads'] = df.apply(lambda row: float(row['Event Count']) if row['Event Name'] == "generate_lead" else 0, axis=1)
+# Column names for the extended report, in the same order as the request dimensions and metrics
+DIMENSION_COLUMNS = ['Date', 'Page Path', 'Session Source', 'Campaign Name', 'Source/Medium', "Lp/Query", 'Event Name']
+METRIC_COLUMNS = ['Sessions', 'Pageviews', 'Bounce Rate', 'Avg. Session Duration', 'New Users', 'Event Count']
+
+# Decode a report response column by column into typed arrays
+# Dimensions become categoricals (the GA4 date dimension a parsed datetime), integer metrics int64 and everything else float64
+def _response_to_frame(response, dimension_columns=DIMENSION_COLUMNS, metric_columns=METRIC_COLUMNS):
+    # Iterating the raw protobuf is much faster than going through the proto-plus wrappers
+    rows = type(response).pb(response).rows
+
+    # Single pass over the rows, appending each value straight into its column
+    dimension_values = [[] for _ in dimension_columns]
+    metric_values = [[] for _ in metric_columns]
+    for row in rows:
+        for column, value in zip(dimension_values, row.dimension_values):
+            column.append(value.value)
+        for column, value in zip(metric_values, row.metric_values):
+            column.append(value.value)
+
+    dimension_names = [header.name for header in response.dimension_headers]
+    metric_types = [header.type_ for header in response.metric_headers]
+
+    columns = {}
+    for i, name in enumerate(dimension_columns):
+        if i < len(dimension_names) and dimension_names[i] == "date":
+            columns[name] = pd.to_datetime(dimension_values[i], format="%Y%m%d")
+        else:
+            columns[name] = pd.Categorical(dimension_values[i])
+
+    for i, name in enumerate(metric_columns):
+        is_integer = i < len(metric_types) and metric_types[i] == MetricType.TYPE_INTEGER
+        columns[name] = np.array(metric_values[i], dtype=np.int64 if is_integer else np.float64)
+
+    return pd.DataFrame(columns)
+
+# Leads are the event counts of generate_lead events, computed with a vectorized mask
+def _add_leads(df):
+    df['Leads'] = np.where(df['Event Name'] == "generate_lead", df['Event Count'], 0).astype(np.float64)
+    return df
 
+# Stitch page frames together, categoricals built per page are re-encoded over the combined values
+def _concat_frames(chunks, dimension_columns=DIMENSION_COLUMNS):
+    df = pd.concat(chunks, ignore_index=True)
+    for name in dimension_columns:
+        if name in df.columns and df[name].dtype == object:
+            df[name] = df[name].astype("category")
     return df
 
+# One report request, traced with the rows and bytes that came back
+# Rate limited and retried per property by the shared scheduler
+def _run_report(client, request):
+    with span("ga4.run_report", offset=request.offset) as current:
+        response = call("ga4", lambda: client.run_report(request), credential=request.property)
+        current.set(rows=len(response.rows), bytes=type(response).pb(response).ByteSize())
+        return response
+
+# Yield report responses page by page, build_request(offset) returns the request for one page
+# The first page tells us how many rows there are in total and the remaining offset pages are then
+# pulled concurrently on a bounded thread pool. A first page that was already fetched (e.g. in a batch) can be passed in.
+# At most max_workers pages are fetched ahead of the consumer, so a slow consumer holds a bounded number of pages,
+# and closing the generator early cancels the pages not yet started.
+def _iter_report_pages(build_request, max_workers=MAX_WORKERS, first_page=None):
+    client = get_client("ga4")
+    if first_page is None:
+        first_page = _run_report(client, build_request(0))
+    yield first_page
+
+    offsets = iter(range(PAGE_SIZE, first_page.row_count, PAGE_SIZE))
+    pool = TracedThreadPoolExecutor(max_workers=max_workers)
+    in_flight = deque()
+    try:
+        # Pages are yielded in offset order, a new page is requested whenever one is handed out
+        for offset in offsets:
+            in_flight.append(pool.submit(_run_report, client, build_request(offset)))
+            if len(in_flight) >= max_workers:
+                break
+        while in_flight:
+            page = in_flight.popleft().result()
+            offset = next(offsets, None)
+            if offset is not None:
+                in_flight.append(pool.submit(_run_report, client, build_request(offset)))
+            yield page
+    finally:
+        for future in in_flight:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+# Streaming variant, yields one DataFrame chunk per page of the report
+def iter_ga4_extended_data(start_date="2024-01-01", end_date=None, max_workers=MAX_WORKERS, property_id=None):
+    end_date = end_date or date.today().strftime("%Y-%m-%d")
+    property_id = property_id or default_property_id()
+    build_request = lambda offset: _build_extended_request(property_id, start_date, end_date, offset=offset)
+    for response in _iter_report_pages(build_request, max_workers=max_workers):
+        with span("ga4.parse", rows=len(response.rows)):
+            chunk = _add_leads(_response_to_frame(response))
+        yield chunk
+
+# Function to fetch GA4 data with search queries, page path, and conversion data
+@traced()
+def fetch_ga4_extended_data(start_date="2024-01-01", end_date=None, max_workers=MAX_WORKERS, property_id=None):
+    chunks = list(iter_ga4_extended_data(start_date, end_date, max_workers=max_workers, property_id=property_id))
+    df = _concat_frames(chunks)
+    df.sort_values(by='Date', inplace=True)
+
+    # Dictionary encoded dimensions and 32-bit metrics, a fraction of the memory of the parsed frame
+    return compact_frame(df)
+
+# Narrow reports
+# The extended report crosses seven dimensions with every event name, far more rows than the summaries need.
+# The planner below works out a few narrow reports instead: sessions by date and each summary dimension, and
+# the generate_lead event counts (filtered on the server) by date and every summary dimension.
+
+# GA4 API names of the dimensions and metrics the narrow reports use
+API_DIMENSIONS = {
+    "Date": "date",
+    "Session Source": "sessionSource",
+    "Page Path": "pagePath",
+    "Campaign Name": "firstUserCampaignName",
+}
+API_METRICS = {
+    "Sessions": "sessions",
+    "Bounce Rate": "bounceRate",
+    "Event Count": "eventCount",
+    "Leads": "eventCount",
+}
+
+# Event counted as a lead
+LEAD_EVENT = "generate_lead"
+
+# Cube dimensions each dashboard summary reads
+SUMMARY_DIMENSIONS = {
+    "acquisition": ["Session Source"],
+    "landing_pages": ["Page Path"],
+}
+
+def _report_name(prefix, dimensions):
+    return prefix + "_by_" + "_".join(dimension.lower().replace(" ", "_") for dimension in dimensions)
+
+# Work out the narrow reports needed for some summaries (default: all of them)
+# Returns {report name: {"dimensions": [...], "metrics": [...], "event_name": ...}}, names are stable so the
+# reports can be stored and cached under them
+def plan_reports(summaries=None):
+    dimensions = []
+    for summary in summaries or SUMMARY_DIMENSIONS:
+        for dimension in SUMMARY_DIMENSIONS[summary]:
+            if dimension not in dimensions:
+                dimensions.append(dimension)
+
+    plan = {}
+    for report_dimensions in [["Date"]] + [["Date", dimension] for dimension in dimensions]:
+        plan[_report_name("sessions", report_dimensions)] = {
+            "dimensions": report_dimensions,
+            "metrics": ["Sessions", "Bounce Rate", "Event Count"],
+            "event_name": None,
+        }
+
+    # Leads are rare, so one report over every dimension at once stays small
+    lead_dimensions = ["Date"] + dimensions
+    plan[_report_name("leads", lead_dimensions)] = {
+        "dimensions": lead_dimensions,
+        "metrics": ["Leads"],
+        "event_name": LEAD_EVENT,
+    }
+    return plan
+
+# Query builder
+# A report spec is a dict with "dimensions" and "metrics" (column names above) and optionally "event_name" (count
+# only that event, filtered on the server)
+def build_query(report, start_date, end_date, property_id=None, offset=0):
+    request = RunReportRequest(
+        dimensions=[Dimension(name=API_DIMENSIONS[name]) for name in report["dimensions"]],
+        metrics=[Metric(name=API_METRICS[name]) for name in report["metrics"]],
+        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+        limit=PAGE_SIZE,
+        offset=offset,
+    )
+    # Requests sent in a batch take their property from the batch
+    if property_id:
+        request.property = f"properties/{property_id}"
+    if report.get("event_name"):
+        # Only rows of this event are counted and returned
+        request.dimension_filter = FilterExpression(filter=Filter(
+            field_name="eventName",
+            string_filter=Filter.StringFilter(value=report["event_name"], match_type=Filter.StringFilter.MatchType.EXACT),
+        ))
+    return request
+
+# batchRunReports accepts at most this many reports per call
+BATCH_SIZE = 5
+
+def _run_batch(client, property_id, requests):
+    request = BatchRunReportsRequest(property=f"properties/{property_id}", requests=requests)
+    with span("ga4.batch_run_reports", reports=len(requests)) as current:
+        response = call("ga4", lambda: client.batch_run_reports(request), credential=request.property)
+        current.set(rows=sum(len(report.rows) for report in response.reports), bytes=type(response).pb(response).ByteSize())
+        return list(response.reports)
+
+# Send report specs through batchRunReports, BATCH_SIZE reports per call and the calls themselves sent concurrently
+# ranges maps every report name to its own (start_date, end_date). Returns {report name: first page response}
+def batch_run_reports(reports, ranges, property_id=None):
+    property_id = property_id or default_property_id()
+    client = get_client("ga4")
+    requests = [build_query(report, *ranges[name]) for name, report in reports.items()]
+    batches = [requests[i:i + BATCH_SIZE] for i in range(0, len(requests), BATCH_SIZE)]
+    if not batches:
+        return {}
+
+    with TracedThreadPoolExecutor(max_workers=len(batches)) as pool:
+        responses = [response for batch in pool.map(lambda batch: _run_batch(client, property_id, batch), batches) for response in batch]
+    return dict(zip(reports, responses))
+
+# Decode a report into a frame, pulling any pages that did not fit into the first response
+def _report_frame(report, first_page, start_date, end_date, property_id, max_workers=MAX_WORKERS):
+    build_request = lambda offset: build_query(report, start_date, end_date, property_id=property_id, offset=offset)
+    pages = _iter_report_pages(build_request, max_workers=max_workers, first_page=first_page)
+
+    chunks = []
+    for response in pages:
+        with span("ga4.parse", rows=len(response.rows)):
+            chunks.append(_response_to_frame(response, report["dimensions"], report["metrics"]))
+    return _concat_frames(chunks, report["dimensions"])
+
+# Fetch every report of a plan, bundled into batch calls, returns {report name: frame}
+# ranges gives reports their own (start_date, end_date), e.g. the days a sync is missing, the rest use start_date..end_date
+@traced(measure=lambda frames: {"rows": sum(len(df) for df in frames.values())})
+def fetch_ga4_reports(plan=None, start_date="2024-01-01", end_date=None, property_id=None, ranges=None):
+    plan = plan or plan_reports()
+    end_date = end_date or date.today().strftime("%Y-%m-%d")
+    property_id = property_id or default_property_id()
+    ranges = {name: (ranges or {}).get(name, (start_date, end_date)) for name in plan}
+    responses = batch_run_reports(plan, ranges, property_id=property_id)
+    frames = {}
+    for name, report in plan.items():
+        df = _report_frame(report, responses[name], *ranges[name], property_id)
+        frames[name] = compact_frame(df.sort_values(by="Date", ignore_index=True))
+    return frames
+
+# Rows shown in the landing page table, the top pages by sessions
+LANDING_PAGE_ROWS = 50
+
+# Percentage columns of the LLM summaries, formatted a whole column at a time
+PERCENT_FORMATTERS = {
+    "Avg. Bounce Rate (%)": lambda values: values.round(2).astype(str) + "%",
+    "Conversion Rate (%)": lambda values: values.astype(str) + "%",
+}
+
+# Columns of a grouped summary as they are shown to the LLM
+def _summary_text_columns(grouped, key_column, label):
+    return pd.DataFrame({
+        label: grouped[key_column],
+        "Sessions": grouped["Sessions"],
+        "Conversions": grouped["Conversions"],
+        "Avg. Bounce Rate (%)": grouped["Bounce_Rate"],
+        "Conversion Rate (%)": grouped["Conversion Rate (%)"],
+    })
+
+# Rows of a summary ranked by impact: leads first, then sessions
+IMPACT_RANKING = ["Conversions", "Sessions"]
+
+# Aggregate for render_table folding the rows that did not fit into one "other" row
+def _other_row(label, noun):
+    def aggregate(rows):
+        sessions = rows["Sessions"].sum()
+        conversions = rows["Conversions"].sum()
+        return {
+            label: f"(other {len(rows):,} {noun})",
+            "Sessions": sessions,
+            "Conversions": conversions,
+            "Avg. Bounce Rate (%)": (rows["Avg. Bounce Rate (%)"] * rows["Sessions"]).sum() / sessions if sessions else 0.0,
+            "Conversion Rate (%)": round(conversions / sessions * 100, 2) if sessions else 0.0,
+        }
+    return aggregate
+
+# Summaries read from the aggregation cube, a raw GA4 frame is turned into a cube first
+def _as_cube(data):
+    if isinstance(data, pd.DataFrame):
+        return build_cube(data)
+    return data
+
 # Get summary of acquisition sources
-def summarize_acquisition_sources(acquisition_data):
-    # Check if required columns are in the dataframe
-    required_cols = ["Session Source", "Sessions", "Bounce Rate", "Event Count"]
-    if not all(col in acquisition_data.columns for col in required_cols):
-        raise ValueError("Data does not contain required columns.")
-    
-    # Convert columns to numeric, if possible, and fill NaNs
-    acquisition_data["Sessions"] = pd.to_numeric(acquisition_data["Sessions"], errors='coerce').fillna(0)
-    acquisition_data["Bounce Rate"] = pd.to_numeric(acquisition_data["Bounce Rate"], errors='coerce').fillna(0)
-    acquisition_data["Leads"] = pd.to_numeric(acquisition_data["Leads"], errors='coerce').fillna(0)
-
-    # Group by Session Source to get aggregated metrics
-    source_summary = acquisition_data.groupby("Session Source").agg(
-        Sessions=("Sessions", "sum"),
-        Bounce_Rate=("Bounce Rate", "mean"),
-        Conversions=("Leads", "sum")
-    ).reset_index()
-
-    # Calculate Conversion Rate
-    source_summary["Conversion Rate (%)"] = (source_summary["Conversions"] / source_summary["Sessions"] * 100).round(2)
-
-    # Sort by Sessions in descending order
-    source_summary = source_summary.sort_values(by="Sessions", ascending=False)
-    
+# max_tokens caps the summary text, the sources that do not fit are added up in an "other" row
+@traced()
+def summarize_acquisition_sources(acquisition_data, fmt="pipe", top_n=None, percentile=None, max_tokens=SUMMARY_TOKEN_BUDGET):
+    cube = _as_cube(acquisition_data)
+    source_summary = summarize_totals(cube["totals"]["Session Source"], "Session Source")
+
     # Format summary text for LLM
-    summary = "Traffic Source Performance Summary:\n"
-    summary += "Source | Sessions | Avg. Bounce Rate (%) | Conversion Rate (%)\n"
-    summary += "-" * 60 + "\n"
-
-    for _, row in source_summary.iterrows():
-        source = row["Session Source"]
-        sessions = row["Sessions"]
-        bounce_rate = round(row["Bounce_Rate"], 2)
-        conversion_rate = row["Conversion Rate (%)"]
-        
-        summary += f"{source} | {sessions} | {bounce_rate}% | {conversion_rate}%,\n"
+    summary = render_table(
+        _summary_text_columns(source_summary, "Session Source", "Source"),
+        title="Traffic Source Performance Summary:",
+        fmt=fmt, top_n=top_n, percentile=percentile,
+        rank_by=IMPACT_RANKING, formatters=PERCENT_FORMATTERS,
+        max_tokens=max_tokens, aggregate=_other_row("Source", "sources"),
+    )
 
     return summary, source_summary
 
 
 # Summarize landing pages
-def summarize_landing_pages(acquisition_data):
-    # Check if required columns are in the dataframe
-    required_cols = ["Page Path", "Sessions", "Bounce Rate", "Leads"]
-    if not all(col in acquisition_data.columns for col in required_cols):
-        raise ValueError("Data does not contain required columns.")
-    
-    # Convert columns to numeric, if possible, and fill NaNs
-    acquisition_data["Sessions"] = pd.to_numeric(acquisition_data["Sessions"], errors='coerce').fillna(0)
-    acquisition_data["Bounce Rate"] = pd.to_numeric(acquisition_data["Bounce Rate"], errors='coerce').fillna(0)
-    acquisition_data["Leads"] = pd.to_numeric(acquisition_data["Leads"], errors='coerce').fillna(0)
-
-    # Group by Page Path to get aggregated metrics
-    page_summary = acquisition_data.groupby("Page Path").agg(
-        Sessions=("Sessions", "sum"),
-        Bounce_Rate=("Bounce Rate", "mean"),
-        Conversions=("Leads", "sum")  # Use Leads for conversions
-    ).reset_index()
-
-    # Calculate Conversion Rate
-    page_summary["Conversion Rate (%)"] = (page_summary["Conversions"] / page_summary["Sessions"] * 100).round(2)
-
-    # Sort by Sessions in descending order
-    page_summary = page_summary.sort_values(by="Sessions", ascending=False)
-    
-    # Format summary text for LLM
-    summary = "Landing Page Performance Summary:\n"
-    summary += "Page Path | Sessions | Avg. Bounce Rate (%) | Conversion Rate (%)\n"
-    summary += "-" * 70 + "\n"
-
-    for _, row in page_summary.iterrows():
-        page_path = row["Page Path"]
-        sessions = row["Sessions"]
-        bounce_rate = round(row["Bounce_Rate"], 2)
-        conversion_rate = row["Conversion Rate (%)"]
-        
-        summary += f"{page_path} | {sessions} | {bounce_rate}% | {conversion_rate}%,\n"
+# max_tokens caps the summary text, the pages that do not fit are added up in an "other" row
+@traced()
+def summarize_landing_pages(acquisition_data, fmt="pipe", top_n=None, percentile=None, max_tokens=SUMMARY_TOKEN_BUDGET):
+    cube = _as_cube(acquisition_data)
+    page_summary = summarize_totals(cube["totals"]["Page Path"], "Page Path")
+
+    # Format summary text for LLM, the pages bringing the most leads and sessions are sent as they are
+    summary = render_table(
+        _summary_text_columns(page_summary, "Page Path", "Page Path"),
+        title="Landing Page Performance Summary:",
+        fmt=fmt, top_n=top_n, percentile=percentile,
+        rank_by=IMPACT_RANKING, formatters=PERCENT_FORMATTERS,
+        max_tokens=max_tokens, aggregate=_other_row("Page Path", "pages"),
+    )
 
     return summary, page_summary
@@ -0,0 +1,284 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+import pandas as pd
+import ga4_data_pull
+from common import to_date, write_json
+from data_cache import cached
+from ga4_cube import build_cube_from_reports, build_prefix_sums
+from frame_memory import compact_frame, restore_dates
+from tracing import TracedThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows, syncs are then only serialized within the process
+    fcntl = None
+
+# Root folder of the local GA4 store, laid out as <property>/<report>/month=YYYY-MM/part-0.parquet
+STORE_DIR = os.environ.get("GA4_STORE_DIR", os.path.join("data", "ga4"))
+
+# First day of history we keep for a property
+HISTORY_START = "2024-01-01"
+
+# GA4 keeps processing late hits for a few days, so the most recent days are always fetched again
+REFETCH_DAYS = 3
+
+# Name of the file recording which date range a report has been synced for
+MANIFEST_FILE = "_manifest.json"
+
+# Name of the empty parquet file keeping a report's columns, so a report synced without any rows still has them
+SCHEMA_FILE = "_schema.parquet"
+
+# Suffix of the lock file next to a report's folder, held while the report is synced
+LOCK_SUFFIX = ".lock"
+
+# Layout version of the partition files, reports written in an older layout are fetched again
+# 2: compact columns, Date stored as int32 days since 1970-01-01
+# 3: one partition per month instead of per day
+# 4: schema file next to the partitions
+STORE_FORMAT = 4
+
+_EPOCH = date(1970, 1, 1)
+_sync_locks = {}
+_sync_locks_lock = threading.Lock()
+
+
+def _report_dir(property_id, report):
+    return os.path.join(STORE_DIR, str(property_id), report)
+
+
+def _partition_dir(report_dir, month):
+    return os.path.join(report_dir, f"month={month}")
+
+
+# "YYYY-MM" of every month overlapping [start, end]
+def _months(start, end):
+    return [f"{month:%Y-%m}" for month in pd.period_range(start, end, freq="M").to_timestamp()]
+
+
+def _day_number(day):
+    return (day - _EPOCH).days
+
+
+# Hold a report's sync lock, so two sessions (threads or processes) syncing the same report take turns
+@contextmanager
+def _report_lock(report_dir):
+    with _sync_locks_lock:
+        thread_lock = _sync_locks.setdefault(report_dir, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(report_dir), exist_ok=True)
+        with open(report_dir + LOCK_SUFFIX, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Read the manifest of a stored report, None if the report has never been synced (in the current layout)
+def read_manifest(property_id, report="extended"):
+    path = os.path.join(_report_dir(property_id, report), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != STORE_FORMAT:
+        return None
+    return {"start": to_date(manifest["start"]), "synced_through": to_date(manifest["synced_through"])}
+
+
+def _write_manifest(report_dir, start, synced_through):
+    write_json(os.path.join(report_dir, MANIFEST_FILE), {
+        "format": STORE_FORMAT, "start": start.isoformat(), "synced_through": synced_through.isoformat(),
+    })
+
+
+# Replace the rows of every day in [start, end] with the freshly fetched rows
+# Only the months the range touches are rewritten, each one in full under a temporary name and then swapped in
+def _write_partitions(report_dir, df, start, end):
+    fresh = compact_frame(df, date_key=True)
+    schema_path = os.path.join(report_dir, SCHEMA_FILE)
+    fresh.head(0).to_parquet(schema_path + ".tmp", index=False)
+    os.replace(schema_path + ".tmp", schema_path)
+    fresh_months = pd.Series(fresh["Date"].to_numpy().astype("datetime64[D]")).dt.strftime("%Y-%m").to_numpy()
+    first, last = _day_number(start), _day_number(end)
+
+    for month in _months(start, end):
+        partition = _partition_dir(report_dir, month)
+        path = os.path.join(partition, "part-0.parquet")
+        parts = [fresh[fresh_months == month]]
+        if os.path.exists(path):
+            stored = pd.read_parquet(path)
+            parts.insert(0, stored[(stored["Date"] < first) | (stored["Date"] > last)])
+
+        month_df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+        if month_df.empty:
+            shutil.rmtree(partition, ignore_errors=True)
+            continue
+        os.makedirs(partition, exist_ok=True)
+        compact_frame(month_df, date_key=True).to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+
+# Work out which date range still has to be fetched for a report
+# Everything after the last synced day is new, plus a window of recent days that GA4 may still revise.
+# The range always joins up with the stored one, so the manifest never claims days that were skipped: days before the
+# stored range are fetched through the day before it, a range starting after it from the day after it.
+def _missing_range(manifest, start, end):
+    if manifest is None:
+        return start, end
+    if start < manifest["start"]:
+        return start, max(end, manifest["start"] - timedelta(days=1))
+
+    refetch_from = manifest["synced_through"] - timedelta(days=REFETCH_DAYS - 1)
+    return min(max(start, refetch_from), manifest["synced_through"] + timedelta(days=1)), end
+
+
+# Date range complete on disk after [fetch_start, fetch_end] was written, the stored range is only widened when the
+# fetched one touches it
+def _synced_range(manifest, fetch_start, fetch_end):
+    if manifest is None:
+        return fetch_start, fetch_end
+    if fetch_start > manifest["synced_through"] + timedelta(days=1) or fetch_end < manifest["start"] - timedelta(days=1):
+        return fetch_start, fetch_end
+    return min(fetch_start, manifest["start"]), max(fetch_end, manifest["synced_through"])
+
+
+# Bring the local copy of a report up to date, fetch(start_date, end_date) must return a frame with a Date column
+# Returns the (start, end) range that was fetched, None when the report was already up to date
+def sync_report(property_id, report, fetch, start_date=HISTORY_START, end_date=None):
+    fetch_many = lambda ranges: {report: fetch(*ranges[report])}
+    return sync_reports(property_id, [report], fetch_many, start_date, end_date).get(report)
+
+
+# Bring several reports of a property up to date together, fetch_many({report: (start_date, end_date)}) is called once
+# with the missing range of every report that has one and must return {report: frame with a Date column}
+# Runs under the sync locks of all the reports, taken in name order so syncs of overlapping sets cannot deadlock. A
+# session waiting for the locks then only fetches what is still missing. Returns {report: (start, end) fetched}
+def sync_reports(property_id, reports, fetch_many, start_date=HISTORY_START, end_date=None):
+    with ExitStack() as stack:
+        for report in sorted(reports):
+            stack.enter_context(_report_lock(_report_dir(property_id, report)))
+        return _sync_reports(property_id, reports, fetch_many, start_date, end_date)
+
+
+def _sync_reports(property_id, reports, fetch_many, start_date, end_date):
+    start = to_date(start_date)
+    end = to_date(end_date) if end_date else date.today()
+
+    manifests, ranges = {}, {}
+    for report in reports:
+        manifests[report] = read_manifest(property_id, report)
+        fetch_start, fetch_end = _missing_range(manifests[report], start, end)
+        if fetch_start <= fetch_end:
+            ranges[report] = (fetch_start, fetch_end)
+    if not ranges:
+        return {}
+
+    frames = fetch_many({report: (first.isoformat(), last.isoformat()) for report, (first, last) in ranges.items()})
+    for report, (fetch_start, fetch_end) in ranges.items():
+        report_dir = _report_dir(property_id, report)
+        # Nothing usable on disk (never synced, or written in an older layout), start over
+        if manifests[report] is None:
+            shutil.rmtree(report_dir, ignore_errors=True)
+        os.makedirs(report_dir, exist_ok=True)
+        _write_partitions(report_dir, frames[report], fetch_start, fetch_end)
+        _write_manifest(report_dir, *_synced_range(manifests[report], fetch_start, fetch_end))
+    return ranges
+
+
+# Read a stored report for a date range straight from the parquet partitions, None if the report was never synced
+# Months are swapped in whole, so a read running next to a sync sees every month either before or after it
+def read_report(property_id, report, start_date=HISTORY_START, end_date=None):
+    if read_manifest(property_id, report) is None:
+        return None
+    report_dir = _report_dir(property_id, report)
+
+    start = to_date(start_date)
+    end = to_date(end_date) if end_date else date.today()
+    paths = [
+        os.path.join(_partition_dir(report_dir, month), "part-0.parquet") for month in _months(start, end)
+    ]
+    frames = [pd.read_parquet(path) for path in paths if os.path.exists(path)]
+    if not frames:
+        # No rows in the range (or none at all), an empty frame with the report's columns
+        frames = [pd.read_parquet(os.path.join(report_dir, SCHEMA_FILE))]
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    days = df["Date"].to_numpy()
+    df = df[(days >= _day_number(start)) & (days <= _day_number(end))]
+    df = restore_dates(df.sort_values(by="Date", ignore_index=True))
+    return compact_frame(df)
+
+
+# Cache key for a GA4 pull: property, resolved date range and the report dimensions
+def _cache_key(start_date=HISTORY_START, end_date=None, property_id=None, sync=True):
+    end = to_date(end_date) if end_date else date.today()
+    return (property_id or ga4_data_pull.default_property_id(), to_date(start_date), end, tuple(ga4_data_pull.DIMENSION_COLUMNS))
+
+
+# Load the extended GA4 report, only the days that are new or may still change are requested from the API
+@cached("ga4", key=_cache_key)
+def load_ga4_data(start_date=HISTORY_START, end_date=None, property_id=None, sync=True):
+    property_id = property_id or ga4_data_pull.default_property_id()
+    if sync:
+        fetch = lambda fetch_start, fetch_end: ga4_data_pull.fetch_ga4_extended_data(fetch_start, fetch_end, property_id=property_id)
+        sync_report(property_id, "extended", fetch, start_date, end_date)
+
+    df = read_report(property_id, "extended", start_date, end_date)
+    if df is None:
+        return ga4_data_pull.fetch_ga4_extended_data(
+            to_date(start_date).isoformat(), end_date and to_date(end_date).isoformat(), property_id=property_id
+        )
+    return df
+
+
+# Load the narrow reports of a plan, each one stored under its own report name
+# The days missing from any of them are fetched together, one batchRunReports call for the whole plan.
+# Returns {report name: frame}
+def load_ga4_reports(plan, start_date=HISTORY_START, end_date=None, property_id=None, sync=True):
+    property_id = property_id or ga4_data_pull.default_property_id()
+    if sync:
+        fetch_many = lambda ranges: ga4_data_pull.fetch_ga4_reports(
+            {name: plan[name] for name in ranges}, property_id=property_id, ranges=ranges
+        )
+        sync_reports(property_id, list(plan), fetch_many, start_date, end_date)
+
+    with TracedThreadPoolExecutor(max_workers=len(plan)) as pool:
+        frames = dict(zip(plan, pool.map(lambda name: read_report(property_id, name, start_date, end_date), plan)))
+
+    # Reports not in the store (only without sync) come straight from the API
+    missing = {name: plan[name] for name, df in frames.items() if df is None}
+    if missing:
+        frames.update(ga4_data_pull.fetch_ga4_reports(
+            missing, to_date(start_date).isoformat(), end_date and to_date(end_date).isoformat(), property_id=property_id
+        ))
+    return frames
+
+
+# Cache key for the cube: property, resolved date range and the summaries it serves
+def _cube_cache_key(start_date=HISTORY_START, end_date=None, property_id=None, sync=True, summaries=None):
+    end = to_date(end_date) if end_date else date.today()
+    summaries = tuple(summaries or ga4_data_pull.SUMMARY_DIMENSIONS)
+    return (property_id or ga4_data_pull.default_property_id(), to_date(start_date), end, summaries)
+
+
+# Aggregation cube for the dashboard summaries, rebuilt only when the underlying data is refreshed
+# Built from the few narrow reports the summaries need rather than the extended report
+@cached("ga4_cube", key=_cube_cache_key)
+def load_ga4_cube(start_date=HISTORY_START, end_date=None, property_id=None, sync=True, summaries=None):
+    plan = ga4_data_pull.plan_reports(summaries)
+    frames = load_ga4_reports(plan, start_date, end_date, property_id=property_id, sync=sync)
+    return build_cube_from_reports(plan, frames)
+
+
+# Running daily totals over the cube, any date window of the dashboard is answered from these without a new fetch
+@cached("ga4_windows", key=_cube_cache_key)
+def load_ga4_windows(start_date=HISTORY_START, end_date=None, property_id=None, sync=True, summaries=None):
+    return build_prefix_sums(load_ga4_cube(start_date, end_date, property_id=property_id, sync=sync, summaries=summaries))
@@ -1,58 +1,103 @@
 import pandas as pd
-from google.ads.googleads.client import GoogleAdsClient
-from google.ads.googleads.errors import GoogleAdsException
 import streamlit as st
+from data_cache import cached
+from clients import get_client
+from rate_limit import ApiError, call
+from tracing import TracedThreadPoolExecutor, traced
 
-def fetch_keyword_data(customer_id, location_ids, language_id, page_url):
-    # Load credentials from Streamlit secrets
-    credentials_dict = {
-        "developer_token": st.secrets["google_ads"]["developer_token"],
-        "client_id": st.secrets["google_ads"]["client_id"],
-        "client_secret": st.secrets["google_ads"]["client_secret"],
-        "refresh_token": st.secrets["google_ads"]["refresh_token"],
-        "login_customer_id": None,  # Optional for test accounts
-        "use_proto_plus": True
-    }
-    
-    # Location and language constants (New York, NY and English as defaults)
-    location_ids = ["1014044"]
-    language_id = "1000"  # English
-
-    # Website URL for generating keyword ideas
-    try:
-        client = GoogleAdsClient.load_from_dict(credentials_dict, version="v18")
-
-        # KeywordPlanIdeaService
-        keyword_plan_idea_service = client.get_service("KeywordPlanIdeaService")
-
-        # Create request
-        request = client.get_type("GenerateKeywordIdeasRequest")
-        request.customer_id = customer_id
-        request.language = client.get_service("GoogleAdsService").language_constant_path(language_id)
-        request.geo_target_constants.extend([
-            client.get_service("GeoTargetConstantService").geo_target_constant_path(location_id)
-            for location_id in location_ids
-        ])
-        request.url_seed.url = page_url
-
-        # Fetch keyword ideas
-        response = keyword_plan_idea_service.generate_keyword_ideas(request=request)
-
-        # Collect data
-        data = []
-        for idea in response:
+# Keyword Planner requests are tightly rate limited, only this many seeds are requested at the same time
+MAX_WORKERS = 2
+
+# Ideas returned per page of a generate_keyword_ideas response
+PAGE_SIZE = 1000
+
+# Output columns, in order
+KEYWORD_COLUMNS = ["Keyword", "Avg Monthly Searches", "Competition", "Low Top of Page Bid (micros)", "High Top of Page Bid (micros)"]
+
+# Build the keyword idea request for a single seed, a URL is used as a page seed and anything else as a keyword
+def _build_request(client, customer_id, location_ids, language_id, seed):
+    request = client.get_type("GenerateKeywordIdeasRequest")
+    request.customer_id = customer_id
+    request.language = client.get_service("GoogleAdsService").language_constant_path(language_id)
+    request.geo_target_constants.extend([
+        client.get_service("GeoTargetConstantService").geo_target_constant_path(location_id)
+        for location_id in location_ids
+    ])
+    request.page_size = PAGE_SIZE
+    if seed.startswith(("http://", "https://")):
+        request.url_seed.url = seed
+    else:
+        request.keyword_seed.keywords.append(seed)
+    return request
+
+# Request one page of keyword ideas, returns (ideas, next page token)
+# Only the page asked for is read, the pager's own lazy paging would fetch later pages outside the scheduler
+def _request_ideas(client, request):
+    keyword_plan_idea_service = client.get_service("KeywordPlanIdeaService")
+    page = keyword_plan_idea_service.generate_keyword_ideas(request=request)
+    return list(page.results), page.next_page_token
+
+# Fetch every keyword idea for one seed, cached per seed so overlapping batches and repeated lookups are instant
+# Every page is its own call, rate limited per customer and retried on its own
+@cached("gaw", key=lambda customer_id, location_ids, language_id, seed: (customer_id, tuple(location_ids), language_id, seed))
+def _fetch_seed(customer_id, location_ids, language_id, seed):
+    client = get_client("google_ads")
+    request = _build_request(client, customer_id, location_ids, language_id, seed)
+
+    # Collect the ideas column by column as the pages come in
+    columns = {name: [] for name in KEYWORD_COLUMNS}
+    while True:
+        ideas, next_page_token = call("google_ads", lambda: _request_ideas(client, request), credential=customer_id)
+        for idea in ideas:
             metrics = idea.keyword_idea_metrics
-            data.append({
-                "Keyword": idea.text,
-                "Avg Monthly Searches": metrics.avg_monthly_searches,
-                "Competition": metrics.competition.name,
-                "Low Top of Page Bid (micros)": metrics.low_top_of_page_bid_micros,
-                "High Top of Page Bid (micros)": metrics.high_top_of_page_bid_micros
-            })
-
-        # Convert to DataFrame
-        return pd.DataFrame(data)
-
-    except GoogleAdsException as ex:
-        st.error(f"GoogleAdsException occurred: {ex}")
-        return pd.DataFrame()  # Return an empty DataFrame on failure
+            columns["Keyword"].append(idea.text)
+            columns["Avg Monthly Searches"].append(metrics.avg_monthly_searches)
+            columns["Competition"].append(metrics.competition.name)
+            columns["Low Top of Page Bid (micros)"].append(metrics.low_top_of_page_bid_micros)
+            columns["High Top of Page Bid (micros)"].append(metrics.high_top_of_page_bid_micros)
+        if not next_page_token:
+            break
+        request.page_token = next_page_token
+
+    df = pd.DataFrame(columns)
+    df["Seed"] = seed
+    return df
+
+# Keyword ideas for many seed URLs or keywords at once
+# Seeds are requested with bounded concurrency on the shared client, ideas returned for several seeds are kept once
+# with every seed that produced them listed in the Seeds column
+@traced()
+def fetch_keyword_ideas(customer_id, seeds, location_ids, language_id, max_workers=MAX_WORKERS):
+    seeds = list(dict.fromkeys(seed.strip() for seed in seeds if seed and seed.strip()))
+    if not seeds:
+        return pd.DataFrame(columns=KEYWORD_COLUMNS + ["Seeds"])
+
+    def fetch(seed):
+        try:
+            return _fetch_seed(customer_id, location_ids, language_id, seed), None
+        except ApiError as ex:
+            return None, ex
+
+    with TracedThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(fetch, seeds))
+
+    frames = []
+    for df, error in results:
+        if error is not None:
+            st.error(f"Keyword ideas could not be fetched: {error}")
+        elif not df.empty:
+            frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(columns=KEYWORD_COLUMNS + ["Seeds"])
+
+    ideas = pd.concat(frames, ignore_index=True)
+    seeds_by_keyword = ideas.groupby("Keyword", sort=False)["Seed"].agg(", ".join)
+    ideas = ideas.drop_duplicates(subset="Keyword").drop(columns="Seed")
+    ideas["Seeds"] = ideas["Keyword"].map(seeds_by_keyword)
+    return ideas.sort_values(by="Avg Monthly Searches", ascending=False, ignore_index=True)
+
+@traced()
+def fetch_keyword_data(customer_id, location_ids, language_id, page_url):
+    # Single page URL lookup, kept for existing callers
+    return fetch_keyword_ideas(customer_id, [page_url], location_ids, language_id)[KEYWORD_COLUMNS]
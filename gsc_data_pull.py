@@ -1,80 +1,170 @@
+import numpy as np
 import pandas as pd
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta
-from google.oauth2 import service_account
-import streamlit as st
+from datetime import date, datetime, timedelta
+from common import to_date
+from data_cache import cached
+from clients import get_client
+from summary_render import SUMMARY_TOKEN_BUDGET, render_table
+from tracing import TracedThreadPoolExecutor, span, traced
+from rate_limit import call
 
-# Define the Google Search Console property URL
+# Define the Google Search Console property URL, used when no site_url is passed
 PROPERTY_URL = 'https://www.chelseawnutrition.com/'  # Replace with your actual website URL in Search Console
 
-# Load the service account credentials from Streamlit secrets
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["google_service_account"],
-    scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-)
+# The Search Console service is built on first use by the client registry, one per thread
+# Search Console returns at most 25,000 rows per request, further rows are paged with startRow
+ROW_LIMIT = 25000
 
-# Initialize the Google Search Console service
-service = build('searchconsole', 'v1', credentials=credentials)
+# Long date ranges are split into shards of this many days which are fetched concurrently
+SHARD_DAYS = 30
+
+# Number of shards fetched at the same time
+MAX_WORKERS = 4
+
+# Column names for the dimensions the API can break results down by
+DIMENSION_COLUMNS = {
+    'query': 'Search Query',
+    'page': 'Page',
+    'date': 'Date',
+    'device': 'Device',
+    'country': 'Country',
+}
+
+# Resolve the requested range, by default everything since the start of 2024
+def _resolve_range(start_date=None, end_date=None):
+    start = to_date(start_date) if start_date else date(2024, 1, 1)
+    end = to_date(end_date) if end_date else datetime.today().date()
+    return start, end
+
+# Split [start, end] into consecutive shards of at most shard_days days
+def _date_shards(start, end, shard_days):
+    shards = []
+    while start <= end:
+        shard_end = min(start + timedelta(days=shard_days - 1), end)
+        shards.append((start, shard_end))
+        start = shard_end + timedelta(days=1)
+    return shards
+
+# Fetch every row of one date shard, paging with startRow until a short page comes back
+def _fetch_shard(start, end, dimensions, search_type, site_url=PROPERTY_URL):
+    rows = []
+    start_row = 0
+    while True:
+        request = {
+            'startDate': start.strftime('%Y-%m-%d'),
+            'endDate': end.strftime('%Y-%m-%d'),
+            'dimensions': list(dimensions),
+            'searchType': search_type,
+            'rowLimit': ROW_LIMIT,
+            'startRow': start_row,
+        }
+        with span("gsc.query", start_date=request['startDate'], start_row=start_row) as current:
+            # Retries are left to the shared scheduler, which limits requests per site
+            response = call(
+                "search_console",
+                lambda: get_client("search_console").searchanalytics().query(siteUrl=site_url, body=request).execute(),
+                credential=site_url,
+            )
+            page = response.get('rows', [])
+            current.set(rows=len(page))
+        rows.extend(page)
+        if len(page) < ROW_LIMIT:
+            return rows
+        start_row += ROW_LIMIT
+
+# Write API rows straight into typed columns
+def _rows_to_frame(rows, dimensions):
+    columns = {}
+    for i, dimension in enumerate(dimensions):
+        values = [row['keys'][i] for row in rows]
+        if dimension == 'date':
+            columns[DIMENSION_COLUMNS[dimension]] = pd.to_datetime(values, format='%Y-%m-%d')
+        elif dimension in ('device', 'country'):
+            columns[DIMENSION_COLUMNS[dimension]] = pd.Categorical(values)
+        else:
+            columns[DIMENSION_COLUMNS[dimension]] = pd.Series(values, dtype=object)
+
+    count = len(rows)
+    columns['Impressions'] = np.fromiter((row.get('impressions', 0) for row in rows), dtype=np.int64, count=count)
+    columns['Clicks'] = np.fromiter((row.get('clicks', 0) for row in rows), dtype=np.int64, count=count)
+    columns['CTR'] = np.fromiter((row.get('ctr', 0) for row in rows), dtype=np.float64, count=count)
+    columns['Avg. Position'] = np.fromiter((row.get('position', 0) for row in rows), dtype=np.float64, count=count)
+    return pd.DataFrame(columns)
+
+# Combine the same keys coming from different shards
+# Clicks and impressions add up, CTR is recomputed and position is averaged weighted by impressions
+def _merge_shards(df, dimensions):
+    keys = [DIMENSION_COLUMNS[dimension] for dimension in dimensions]
+    df = df.assign(_weighted_position=df['Avg. Position'] * df['Impressions'])
+    merged = df.groupby(keys, observed=True, sort=False).agg(
+        Impressions=('Impressions', 'sum'),
+        Clicks=('Clicks', 'sum'),
+        _weighted_position=('_weighted_position', 'sum'),
+    ).reset_index()
+    impressions = merged['Impressions'].where(merged['Impressions'] > 0)
+    merged['CTR'] = (merged['Clicks'] / impressions).fillna(0)
+    merged['Avg. Position'] = (merged['_weighted_position'] / impressions).fillna(0)
+    return merged.drop(columns='_weighted_position')
+
+# Cache key for a Search Console pull: property, resolved date range, dimensions and search type
+def _cache_key(start_date=None, end_date=None, dimensions=('query',), search_type='web', shard_days=SHARD_DAYS, max_workers=MAX_WORKERS, site_url=None):
+    start, end = _resolve_range(start_date, end_date)
+    return (site_url or PROPERTY_URL, start, end, tuple(dimensions), search_type)
 
 # Define a function to fetch Google Search Console data
-def fetch_search_console_data(start_date=None, end_date=None):
-    # Default to last 30 days if no date range is provided
-    if not start_date:
-        end_date = datetime.today()
-        start_date = "2024-01-01"
-    
-    # Format dates as strings for the API
-    start_date_str = start_date
-    end_date_str = end_date.strftime('%Y-%m-%d')
-
-    # Create the request payload
-    request = {
-        'startDate': start_date_str,
-        'endDate': end_date_str,
-        'dimensions': ['query'],  # Break down by search query
-        'searchType': 'web',
-        'rowLimit': 1000  # Adjust if needed, max 25,000 per call
+# Long ranges are split into date shards fetched concurrently, each shard is paged until all rows are read
+@traced()
+@cached("gsc", key=_cache_key)
+def fetch_search_console_data(start_date=None, end_date=None, dimensions=('query',), search_type='web', shard_days=SHARD_DAYS, max_workers=MAX_WORKERS, site_url=None):
+    site_url = site_url or PROPERTY_URL
+    start, end = _resolve_range(start_date, end_date)
+    dimensions = tuple(dimensions)
+    shards = _date_shards(start, end, shard_days)
+
+    with TracedThreadPoolExecutor(max_workers=max_workers) as pool:
+        shard_rows = list(pool.map(lambda shard: _fetch_shard(shard[0], shard[1], dimensions, search_type, site_url), shards))
+
+    rows = [row for shard in shard_rows for row in shard]
+    df = _rows_to_frame(rows, dimensions)
+
+    # Without a date breakdown the same key can come back from several shards
+    if len(shards) > 1 and 'date' not in dimensions:
+        df = _merge_shards(df, dimensions)
+
+    df = df[[DIMENSION_COLUMNS[dimension] for dimension in dimensions] + ['Impressions', 'Clicks', 'CTR', 'Avg. Position']]
+    return df.sort_values(by=['Clicks', 'Impressions'], ascending=False, ignore_index=True)
+
+
+# Aggregate for render_table folding the queries that did not fit into one "other" row
+def _other_queries(rows):
+    impressions = rows["Impressions"].sum()
+    return {
+        "Query": f"(other {len(rows):,} queries)",
+        "Impressions": impressions,
+        "Clicks": rows["Clicks"].sum(),
+        "Avg. Position": (rows["Avg. Position"] * rows["Impressions"]).sum() / impressions if impressions else 0.0,
     }
-    
-    # Run the query
-    response = service.searchanalytics().query(siteUrl=PROPERTY_URL, body=request).execute()
-    
-    # Parse response into a list of rows
-    rows = []
-    for row in response.get('rows', []):
-        query = row['keys'][0]
-        impressions = row.get('impressions', 0)
-        clicks = row.get('clicks', 0)
-        ctr = row.get('ctr', 0)
-        position = row.get('position', 0)
-        rows.append([query, impressions, clicks, ctr, position])
-    
-    # Load the data into a DataFrame
-    df = pd.DataFrame(rows, columns=['Search Query', 'Impressions', 'Clicks', 'CTR', 'Avg. Position'])
-    return df
-
-
-# Function to create a summary of the top 30 search queries for LLM consumption
-def summarize_search_queries(search_data):
+
+
+# Function to create a summary of the search queries for LLM consumption
+# Queries are ranked by impressions, then clicks, and as many as fit in max_tokens are listed, the rest are added up
+# in an "other" row. top_n optionally caps the listed queries
+@traced()
+def summarize_search_queries(search_data, fmt="pipe", top_n=None, max_tokens=SUMMARY_TOKEN_BUDGET):
     # Ensure necessary columns are present
     if not all(col in search_data.columns for col in ["Search Query", "Impressions", "Clicks", "Avg. Position"]):
         raise ValueError("Data does not contain required columns.")
 
-    # Sort by Avg. Position and select top 30
-    top_queries = search_data.sort_values(by="Avg. Position").head(30)
-    top_queries["Avg. Position"] = top_queries["Avg. Position"].round(0).astype(int)
-    
     # Format the summary as a readable text
-    summary = "Top 30 Search Queries Summary:\n"
-    summary += "Query | Impressions | Clicks | Avg. Position\n"
-    summary += "-" * 50 + "\n"
-
-    for _, row in top_queries.iterrows():
-        query = row["Search Query"]
-        impressions = row["Impressions"]
-        clicks = row["Clicks"]
-        avg_position = row["Avg. Position"]
-        
-        summary += f"{query} | {impressions} | {clicks} | {avg_position},\n"
-    
-    return summary
+    return render_table(
+        pd.DataFrame({
+            "Query": search_data["Search Query"],
+            "Impressions": search_data["Impressions"],
+            "Clicks": search_data["Clicks"],
+            "Avg. Position": search_data["Avg. Position"],
+        }),
+        title="Search Queries by Impressions:",
+        fmt=fmt, top_n=top_n,
+        rank_by=["Impressions", "Clicks"], max_tokens=max_tokens, aggregate=_other_queries,
+        formatters={"Avg. Position": lambda values: values.round(0).astype(int)},
+    )
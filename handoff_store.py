@@ -0,0 +1,117 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+import pandas as pd
+
+# Hands analyses and fetched frames from one app to another (e.g. the dashboard to the SEO helper)
+# The sending app stores them under a short ID and only puts ?handoff=<id> in the link, the receiving app reads them
+# back from here instead of from the URL or from the APIs. Both apps have to share the HANDOFF_PATH file.
+
+# SQLite file holding the handoffs
+HANDOFF_PATH = os.environ.get("HANDOFF_PATH", os.path.join("data", "handoff.sqlite3"))
+
+# How long a handoff can be opened, every new link to the same content extends it
+TTL_SECONDS = int(os.environ.get("HANDOFF_TTL_SECONDS", 24 * 60 * 60))
+
+# Where the SEO helper is deployed, apps link to it with a handoff
+SEO_HELPER_URL = os.environ.get("SEO_HELPER_URL", "https://smartmetric-seobuddy.streamlit.app")
+
+# Characters of the handoff IDs
+ID_LENGTH = 12
+
+# Query parameter carrying the ID
+HANDOFF_PARAM = "handoff"
+
+
+# Disk-backed handoffs with expiry, frames are kept as parquet
+# A fresh connection is opened per operation so the store can be shared between threads and processes
+class HandoffStore:
+    def __init__(self, path=HANDOFF_PATH, ttl=TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS handoffs ("
+                "id TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS handoff_frames ("
+                "id TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (id, name))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS handoffs_expires ON handoffs (expires_at)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    # ID of a handoff's content, the same analysis and frames always get the same short ID
+    @staticmethod
+    def id_for(payload, frames):
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8"))
+        for name in sorted(frames):
+            digest.update(name.encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(frames[name], index=False).to_numpy().tobytes())
+        return digest.hexdigest()[:ID_LENGTH]
+
+    # Store a handoff and return its ID, payload is JSON-serializable (e.g. {"message": analysis})
+    # frames maps a name to a DataFrame. Content already stored only has its expiry extended
+    def put(self, payload, frames=None):
+        frames = frames or {}
+        handoff_id = self.id_for(payload, frames)
+        now = time.time()
+        with self._connect() as conn:
+            self._purge(conn, now)
+            updated = conn.execute("UPDATE handoffs SET expires_at = ? WHERE id = ?", (now + self.ttl, handoff_id)).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO handoffs (id, payload, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (handoff_id, json.dumps(payload, default=str), now, now + self.ttl),
+                )
+                for name, frame in frames.items():
+                    buffer = io.BytesIO()
+                    frame.to_parquet(buffer, index=False)
+                    conn.execute(
+                        "INSERT INTO handoff_frames (id, name, data) VALUES (?, ?, ?)",
+                        (handoff_id, name, buffer.getvalue()),
+                    )
+        conn.close()
+        return handoff_id
+
+    # {"payload": ..., "frames": {name: DataFrame}, "created_at": ...} of a handoff, None when unknown or expired
+    def get(self, handoff_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, created_at FROM handoffs WHERE id = ? AND expires_at >= ?", (handoff_id, time.time())
+            ).fetchone()
+            frame_rows = conn.execute("SELECT name, data FROM handoff_frames WHERE id = ?", (handoff_id,)).fetchall() if row else []
+        conn.close()
+
+        if row is None:
+            return None
+        return {
+            "payload": json.loads(row[0]),
+            "frames": {name: pd.read_parquet(io.BytesIO(data)) for name, data in frame_rows},
+            "created_at": row[1],
+        }
+
+    # Drop expired handoffs and their frames
+    def _purge(self, conn, now):
+        conn.execute("DELETE FROM handoff_frames WHERE id IN (SELECT id FROM handoffs WHERE expires_at < ?)", (now,))
+        conn.execute("DELETE FROM handoffs WHERE expires_at < ?", (now,))
+
+
+# Shared instance used by the apps
+handoff_store = HandoffStore()
+
+
+# Link to another app that hands it the payload and frames, e.g. handoff_link(SEO_HELPER_URL, {"message": ...})
+def handoff_link(app_url, payload, frames=None):
+    return f"{app_url}?{HANDOFF_PARAM}={handoff_store.put(payload, frames)}"
@@ -5,7 +5,8 @@ from datetime import date
 from ga4_data_pull import fetch_ga4_extended_data, summarize_acquisition_sources, summarize_landing_pages
 from gsc_data_pull import fetch_search_console_data, summarize_search_queries
 from llm_integration import initialize_llm_context, query_gpt
-from urllib.parse import quote
+from handoff_store import SEO_HELPER_URL, handoff_link
+from rate_limit import ApiError
 
 # Page configuration
 st.set_page_config(layout="wide")
@@ -19,9 +20,12 @@ def display_report_with_llm(summary_func, llm_prompt):
     # Generate summary
     summary = summary_func()
 
-    # Query LLM with specific prompt
-    llm_response = query_gpt(llm_prompt, summary)
-    return llm_response
+    # Query LLM with specific prompt, an API failure is shown in place of the analysis
+    try:
+        return query_gpt(llm_prompt, summary)
+    except ApiError as e:
+        st.error(f"The analysis could not be generated: {e}")
+        return ""
 
 
 # Main function to handle the workflow
@@ -68,10 +72,10 @@ def main():
             """
         )
         st.write(response)
-        # Store a message to pass to the SEO helper
-        encoded_message = quote(str(response))
-        seo_url = f"https://smartmetric-seobuddy.streamlit.app?message={encoded_message}"
-        st.link_button("Check Out our SEO Helper!!", seo_url)
+        # Hand the analysis and the search query data to the SEO helper, only a short ID goes in the link
+        if response:
+            seo_url = handoff_link(SEO_HELPER_URL, {"message": str(response)}, {"search_data": search_data})
+            st.link_button("Check Out our SEO Helper!!", seo_url)
 
     ### Display Acquisition Section
     st.divider()
@@ -145,10 +149,13 @@ def main():
     # Process the user question if entered
     if user_question:
         # Generate response from GPT-4 using the stored context
-        llm_response = query_gpt(user_question)
-        
-        # Append the new question and response to the conversation history
-        st.session_state["conversation_history"].append({"question": user_question, "response": llm_response})
+        try:
+            llm_response = query_gpt(user_question)
+        except ApiError as e:
+            st.error(f"The question could not be answered: {e}")
+        else:
+            # Append the new question and response to the conversation history
+            st.session_state["conversation_history"].append({"question": user_question, "response": llm_response})
     
     # Display the full conversation history
     st.subheader("Conversation History")
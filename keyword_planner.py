@@ -1,12 +1,12 @@
 import streamlit as st
-from gaw_data_pull import fetch_keyword_data
+from gaw_data_pull import fetch_keyword_ideas
 
 # Streamlit App Title
 st.title("Google Ads Keyword Planner")
 
 # Input Fields
 st.subheader("Enter Details for Keyword Ideas:")
-page_url = st.text_input("Website URL", value="https://example.com")
+seed_text = st.text_area("Website URLs or keywords (one per line)", value="https://example.com")
 customer_id = "6318131495"
 location_ids = ["1014044"]  # Seattle, WA
 language_id = "1000"  # English
@@ -14,7 +14,7 @@ language_id = "1000"  # English
 # Fetch Button
 if st.button("Fetch Keyword Data"):
     with st.spinner("Fetching keyword data..."):
-        df = fetch_keyword_data(customer_id, location_ids, language_id, page_url)
+        df = fetch_keyword_ideas(customer_id, seed_text.splitlines(), location_ids, language_id)
         if not df.empty:
             st.success("Data fetched successfully!")
             st.dataframe(df)
@@ -26,7 +26,7 @@ st.sidebar.header("Instructions")
 st.sidebar.write(
     """
     1. Enter your **Customer ID** (Test Account only).
-    2. Provide a valid **Website URL**.
+    2. Provide one or more **Website URLs** or seed keywords, one per line.
     3. Click **Fetch Keyword Data** to see keyword suggestions.
     """
 )
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file holding cached LLM answers
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join("data", "llm_cache.sqlite3"))
+
+# Total size of stored answers before the least recently used ones are evicted
+MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Optional expiry in seconds, None keeps answers until they are evicted
+TTL_SECONDS = int(os.environ["LLM_CACHE_TTL_SECONDS"]) if os.environ.get("LLM_CACHE_TTL_SECONDS") else None
+
+
+# Disk-backed, content-addressed cache of LLM answers
+# A fresh connection is opened per operation so the cache can be shared between threads and processes
+class LLMCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    # Hash of everything that determines the model's answer
+    @staticmethod
+    def key_for(model, system_prompt, context, data_summary, prompt):
+        payload = json.dumps([model, system_prompt, context, data_summary, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Cached answer for a key, None on a miss
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT answer, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] + self.ttl < now:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.close()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    # Store an answer, nothing is stored for an empty answer (e.g. a content-filtered completion has none)
+    def set(self, key, answer):
+        if not answer:
+            return
+        now = time.time()
+        size = len(answer.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, answer, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, answer, size, now, now),
+            )
+            self._evict(conn)
+        conn.close()
+
+    # Drop least recently used answers until the stored size fits the budget
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+        conn.close()
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": stored,
+        }
+
+
+# Shared instance used by query_gpt
+response_cache = LLMCache()
@@ -0,0 +1,132 @@
+import hashlib
+import re
+
+# Token budget for the conversation context sent with every question (business context + history)
+CONTEXT_TOKEN_BUDGET = 2000
+
+# Number of most recent exchanges that are always sent verbatim
+RECENT_TURNS = 3
+
+# Longest line an older exchange is condensed to in the digest
+DIGEST_LINE_CHARS = 200
+
+# Loaded tokenizers by model, None when tiktoken or its encoding files are unavailable
+_encodings = {}
+
+
+# tiktoken is imported on first use so it does not slow down app start
+def _encoding(model):
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Not installed, or the encoding files could not be loaded (e.g. offline)
+            _encodings[model] = None
+    return _encodings[model]
+
+
+# Count tokens the way the model will, or estimate them (~4 characters per token) when no tokenizer is available
+def count_tokens(text, model="gpt-4o-mini"):
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+# Cut text down to at most max_tokens, at a line break when one falls in the half of what is kept next to the cut
+# keep_end keeps the end of the text rather than its start, e.g. for a conversation whose latest turns matter most
+def truncate_tokens(text, max_tokens, model="gpt-4o-mini", keep_end=False):
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    max_tokens = max(0, max_tokens)
+    encoding = _encoding(model)
+    if encoding is None:
+        kept = (text[len(text) - max_tokens * 4:] if max_tokens else "") if keep_end else text[:max_tokens * 4]
+    else:
+        tokens = encoding.encode(text)
+        kept = encoding.decode(tokens[len(tokens) - max_tokens:] if keep_end else tokens[:max_tokens])
+        # Decoding a token slice can re-encode to a few more tokens, drop characters until it fits
+        while kept and count_tokens(kept, model) > max_tokens:
+            kept = kept[1:] if keep_end else kept[:-1]
+
+    if keep_end:
+        line_start = kept.find("\n")
+        return kept[line_start + 1:] if -1 < line_start < len(kept) // 2 else kept
+    line_end = kept.rfind("\n")
+    return kept[:line_end] if line_end > len(kept) // 2 else kept
+
+
+def _first_sentence(text):
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    return match.group(1) if match else text
+
+
+# Condense an exchange into a single digest line
+def _condense(prompt, answer):
+    line = f"- Q: {_first_sentence(prompt)} A: {_first_sentence(answer)}"
+    if len(line) > DIGEST_LINE_CHARS:
+        line = line[:DIGEST_LINE_CHARS - 3].rstrip() + "..."
+    return line
+
+
+def _format_turn(prompt, answer):
+    return f"\nUser: {prompt}\nModel: {answer}\n"
+
+
+# Conversation history kept within a token budget
+# The business context and the most recent exchanges are sent verbatim, older exchanges are folded into
+# a rolling digest of one line each, and the oldest digest lines are dropped once even the digest no longer fits
+class ConversationContext:
+    def __init__(self, business_context, token_budget=CONTEXT_TOKEN_BUDGET, recent_turns=RECENT_TURNS, model="gpt-4o-mini"):
+        self.business_context = business_context
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.model = model
+        self.turns = []
+        self.digest = []
+        self._seen = set()
+
+    def add_turn(self, prompt, answer):
+        # Cached answers come back on every rerun, only record each exchange once
+        fingerprint = hashlib.sha256(f"{prompt}\0{answer}".encode("utf-8")).hexdigest()
+        if fingerprint in self._seen:
+            return
+        self._seen.add(fingerprint)
+
+        self.turns.append((prompt, answer))
+        self._compact()
+
+    def _compact(self):
+        while len(self.turns) > self.recent_turns:
+            self.digest.append(_condense(*self.turns.pop(0)))
+
+        # Keep at least the latest exchange verbatim, whatever its size
+        while len(self.turns) > 1 and self.tokens() > self.token_budget:
+            self.digest.append(_condense(*self.turns.pop(0)))
+
+        while self.digest and self.tokens() > self.token_budget:
+            self.digest.pop(0)
+
+    # The conversation as sent to the model, max_tokens renders it compacted into a smaller budget
+    # (older turns folded into the digest and the oldest digest lines dropped first), without changing the history
+    def render(self, max_tokens=None):
+        if max_tokens is not None and max_tokens < self.token_budget and self.tokens() > max_tokens:
+            smaller = ConversationContext(self.business_context, max_tokens, self.recent_turns, self.model)
+            smaller.turns, smaller.digest = list(self.turns), list(self.digest)
+            smaller._compact()
+            return smaller.render()
+
+        text = self.business_context
+        if self.digest:
+            text += "\nEarlier in this conversation:\n" + "\n".join(self.digest) + "\n"
+        return text + "".join(_format_turn(prompt, answer) for prompt, answer in self.turns)
+
+    def tokens(self):
+        return count_tokens(self.render(), self.model)
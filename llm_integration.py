@@ -1,40 +1,302 @@
-from openai import OpenAI
+import queue
+import time
+from collections import deque
 import streamlit as st
+from llm_cache import response_cache
+from llm_context import CONTEXT_TOKEN_BUDGET, ConversationContext, count_tokens, truncate_tokens
+from clients import get_client
+from tracing import TracedThreadPoolExecutor, span, traced
+from rate_limit import ApiError, as_api_error, call, is_api_error
+from summary_render import SUMMARY_TOKEN_BUDGET
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=st.secrets["openai"]["api_key"])
+# The OpenAI client is built on first use by the client registry
+
+# Model and system prompt used for every analysis, both are part of the response cache key
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are a data analyst with a focus on digital growth and conversion optimization."
+
+# How many analyses a batch sends to the API at the same time
+MAX_CONCURRENT_REQUESTS = 3
+
+# Most tokens each section of a prompt may take up, longer sections are cut (see budget_prompt)
+# Data summaries already fit their budget when they come from the summarize functions, which fold the tail of their
+# tables into an "other" row, the cut is the fallback for free text such as scraped page copy
+PROMPT_SECTION_BUDGETS = {
+    "context": CONTEXT_TOKEN_BUDGET,
+    "data": SUMMARY_TOKEN_BUDGET,
+    "question": 1000,
+}
+
+# Added where a section was cut so the model knows it is looking at part of it
+TRUNCATION_NOTE = "\n[... cut to fit the prompt budget]"
+CONTEXT_TRUNCATION_NOTE = "[... earlier context cut to fit the prompt budget]\n"
 
 # Business context for session memory
 business_context = """
 Answer these questions based on this context: The data is from a one-person dietitian business that began about a year ago. The dietitian has some technical 
 skills and seeks to use GA4 data to grow her website’s performance and make clear, actionable business decisions. Keep insights simple, specific, and free from jargon. 
 Keep a few key things in mind, she is in lynnwood Washing just outside Seattle. She is hoping to work specifcally with Adults with Eating disorders. A conversion event 
-for her is someone going to the contact page and filling out a contact form (a lead). Keep in mind this data is from this year summarized for that whole time period.
+for her is someone going to the contact page and filling out a contact form (a lead).
 """
 
+# Tells the model which period the data summaries cover
+DATE_RANGE_NOTE = "Keep in mind this data is from {start:%B %d, %Y} to {end:%B %d, %Y} ({days} days) summarized for that whole time period."
+
+# Business context stating the date range the data covers, context defaults to this site's business context
+def date_range_context(start, end, context=None):
+    note = DATE_RANGE_NOTE.format(start=start, end=end, days=(end - start).days + 1)
+    return f"{(context or business_context).rstrip()} {note}\n"
+
+# Prompts for the three dashboard analyses
+SEARCH_QUERY_PROMPT = """
+            Based on this Search Query Report from Google give tips as to possible Paid Search Strategy and SEO optimization. Try to best answer the question, 
+            What are people searching for when they come to my site and how can I get more of these users? Give me a brief analysis then 4 bullet points with 
+            concrete tips for improvement. Limit this repsonse to ~ 200 words!
+            """
+
+ACQUISITION_PROMPT = """
+            Analyze this acquisition report and provide insights on traffic sources and recommendations for improvement. Add insight as to how we might we might 
+            improve the site based on this data. Give me a brief analysis then 4 bullet points with concrete tips for improvement. Limit this repsonse to ~ 200 words!
+            """
+
+LANDING_PAGE_PROMPT = """
+            Review this conversion rate report and suggest optimizations for improving lead generation and user engagement. Keep in mind that for someone to quantify 
+            as a lead they need to go to the contacts page and fill out the form. So if landing page or source has a high conversion rate it means it ultimately led a user to the contacts page.
+            Give me a brief analysis then 4 bullet points with concrete tips for improvement. Limit this repsonse to ~ 200 words!
+            """
+
 def initialize_llm_context():
     if "session_summary" not in st.session_state:
         st.session_state["session_summary"] = business_context
+    _conversation()
+
+# Token-budgeted conversation history for this session, session_summary always holds its rendered text
+# Apps that only set session_summary get a history seeded from it on first use
+def _conversation():
+    if "llm_context" not in st.session_state:
+        st.session_state["llm_context"] = ConversationContext(st.session_state.get("session_summary", ""))
+        st.session_state["session_summary"] = st.session_state["llm_context"].render()
+    return st.session_state["llm_context"]
 
-def query_gpt(prompt, data_summary=""):
+# Switch the session's conversation to a new business context, e.g. once the date range changed
+def set_business_context(context):
+    conversation = _conversation()
+    if conversation.business_context != context:
+        conversation.business_context = context
+        st.session_state["session_summary"] = conversation.render()
+
+# Requests kept in the session's token log, the oldest ones are dropped
+TOKEN_LOG_SIZE = 50
+
+# Keep a log of the input tokens of each request that went to the API: the local estimate and what the API counted
+# tokens is None for an answer from the cache (every rerun of the dashboard gets its analyses from there), actual is
+# None when the API did not report usage
+def _log_tokens(prompt, tokens):
+    if tokens is None:
+        return
+    estimated, actual = tokens
+    st.session_state.setdefault("token_log", deque(maxlen=TOKEN_LOG_SIZE)).append({
+        "question": prompt.strip()[:80], "estimated_tokens": estimated, "actual_tokens": actual,
+    })
+
+# Cut text to at most max_tokens, marking where it was cut
+# keep_end cuts from the front instead, keeping the end of the text
+def fit_text(text, max_tokens, keep_end=False):
+    if count_tokens(text, MODEL) <= max_tokens:
+        return text
+    if keep_end:
+        kept = truncate_tokens(text, max_tokens - count_tokens(CONTEXT_TRUNCATION_NOTE, MODEL), MODEL, keep_end=True)
+        return CONTEXT_TRUNCATION_NOTE + kept.lstrip()
+    return truncate_tokens(text, max_tokens - count_tokens(TRUNCATION_NOTE, MODEL), MODEL).rstrip() + TRUNCATION_NOTE
+
+# The session's conversation rendered within the context budget, see ConversationContext.render
+def _session_context():
+    return _conversation().render(max_tokens=PROMPT_SECTION_BUDGETS["context"])
+
+# Fit each section of a request into its PROMPT_SECTION_BUDGETS budget
+# The session's conversation is already compacted to the budget by _session_context, any other context that is too long
+# is cut from the front, so the latest turns survive like they do in ConversationContext
+# Returns (prompt, data_summary, context, names of the sections that were cut)
+def budget_prompt(prompt, data_summary, context):
+    sections = {"question": prompt, "data": data_summary, "context": context}
+    fitted = {name: fit_text(text, PROMPT_SECTION_BUDGETS[name], keep_end=name == "context") for name, text in sections.items()}
+    cut = [name for name in sections if fitted[name] != sections[name]]
+    return fitted["question"], fitted["data"], fitted["context"], cut
+
+# Response cache key of a fully specified request, as it is sent once fitted into the budget
+def answer_key(prompt, data_summary, context):
+    prompt, data_summary, context, _ = budget_prompt(prompt, data_summary, context)
+    return response_cache.key_for(MODEL, SYSTEM_PROMPT, context, data_summary, prompt)
+
+# Store answers produced elsewhere (e.g. a precomputed snapshot) so matching requests are answered without the API
+# answers maps answer_key(...) to the answer
+def prime_answers(answers):
+    for key, answer in answers.items():
+        response_cache.set(key, answer)
+
+# Read a streamed completion, passing every piece of text to on_delta as it arrives
+# Returns (answer, usage), usage comes with the last chunk when the stream was asked to include it
+def _read_stream(stream, on_delta, current, started):
+    parts, usage = [], None
     try:
-        session_summary = st.session_state.get("session_summary", "")
-        full_prompt = f"{session_summary}\n\nData Summary:\n{data_summary}\n\nUser Question: {prompt}"
-
-        # Send the prompt to GPT-4 through the OpenAI client instance
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a data analyst with a focus on digital growth and conversion optimization."},
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    current.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                parts.append(delta)
+                on_delta(delta)
+    except Exception as e:
+        # Before any text arrived the failure is left to call(), which retries it like any other failed request.
+        # Once part of the answer is on screen the request is not retried, the failure is raised as call() would.
+        if not parts or not is_api_error(e):
+            raise
+        raise as_api_error("openai", e) from e
+    return "".join(parts), usage
+
+# Get the model's answer for a fully specified request, served from the response cache when possible
+# With on_delta the answer is streamed and on_delta(text) is called with every piece as it arrives, a cached answer
+# arrives as one piece. Does not touch st.session_state so it is safe to call from worker threads
+# Returns (answer, (estimated, actual) input tokens or None when cached), see _log_tokens
+def _complete(prompt, data_summary, context, on_delta=None):
+    prompt, data_summary, context, cut = budget_prompt(prompt, data_summary, context)
+    full_prompt = f"{context}\n\nData Summary:\n{data_summary}\n\nUser Question: {prompt}"
+
+    with span("llm.complete", model=MODEL, stream=on_delta is not None) as current:
+        cache_key = response_cache.key_for(MODEL, SYSTEM_PROMPT, context, data_summary, prompt)
+        answer = response_cache.get(cache_key)
+        tokens = None
+        current.set(cache_hit=answer is not None)
+        if cut:
+            current.set(truncated=",".join(cut))
+
+        if answer is not None and on_delta:
+            on_delta(answer)
+
+        if answer is None:
+            estimated = count_tokens(SYSTEM_PROMPT, MODEL) + count_tokens(full_prompt, MODEL)
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": full_prompt}
             ]
-        )
-        
-        # Access the response using dot notation
-        answer = response.choices[0].message.content
-        st.session_state["session_summary"] += f"\nUser: {prompt}\nModel: {answer}\n"
-        
-        return answer
+            started = time.perf_counter()
 
-    except Exception as e:
-        return f"Error: {e}"
+            # Send the prompt to GPT-4 through the OpenAI client instance, throttling and outages are retried
+            if on_delta is None:
+                response = call("openai", lambda: get_client("openai").chat.completions.create(model=MODEL, messages=messages))
+                # Access the response using dot notation
+                answer = response.choices[0].message.content or ""
+                usage = getattr(response, "usage", None)
+            else:
+                # The stream is read inside call(), so it holds its slot of the concurrency budget until the last chunk
+                answer, usage = call("openai", lambda: _read_stream(get_client("openai").chat.completions.create(
+                    model=MODEL, messages=messages, stream=True, stream_options={"include_usage": True},
+                ), on_delta, current, started))
+
+            response_cache.set(cache_key, answer)
+
+            # The local estimate next to the token counts reported by the API (None when the response has none)
+            actual = getattr(usage, "prompt_tokens", None)
+            tokens = (estimated, actual)
+            current.set(
+                estimated_prompt_tokens=estimated,
+                prompt_tokens=actual,
+                completion_tokens=getattr(usage, "completion_tokens", None),
+            )
+
+        current.set(bytes=len(full_prompt.encode("utf-8")))
+
+    return answer, tokens
+
+# Record an exchange in the conversation history and refresh the session summary
+def _remember(prompt, answer):
+    conversation = _conversation()
+    conversation.add_turn(prompt, answer)
+    st.session_state["session_summary"] = conversation.render()
+
+# Ask the model a question, context defaults to the (compacted) conversation so far
+# Identical requests are answered from the response cache without calling the API
+# Raises an ApiError when the API cannot answer, nothing is added to the conversation then
+@traced()
+def query_gpt(prompt, data_summary="", context=None):
+    session_summary = _session_context() if context is None else context
+    answer, tokens = _complete(prompt, data_summary, session_summary)
+    _log_tokens(prompt, tokens)
+    _remember(prompt, answer)
+    return answer
+
+# Stream the answers of independent (prompt, data_summary) jobs, sent concurrently
+# Yields (index, text so far, done, error) whenever a job has new text, pieces that arrived together are yielded at
+# once. A job ends with done=True, error is the ApiError of a job the API could not (fully) answer, failed jobs do not
+# stop the others. All jobs see the same context, the finished answers are cached and added to the conversation once
+# every job is done and always in job order, so the result does not depend on which request came back first.
+def stream_gpt_batch(jobs, context=None, max_workers=MAX_CONCURRENT_REQUESTS):
+    if context is None:
+        context = _session_context()
+
+    # Worker threads report (index, delta, (answer, tokens), error) on one queue, the caller's thread renders
+    events = queue.Queue()
+
+    def run(i, prompt, data_summary):
+        try:
+            result = _complete(prompt, data_summary, context, on_delta=lambda delta: events.put((i, delta, None, None)))
+            events.put((i, None, result, None))
+        except Exception as e:
+            events.put((i, None, None, e))
+
+    texts = [""] * len(jobs)
+    results = [None] * len(jobs)
+    with TracedThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i, (prompt, data_summary) in enumerate(jobs):
+            pool.submit(run, i, prompt, data_summary)
+
+        pending = len(jobs)
+        while pending:
+            arrived = [events.get()]
+            while not events.empty():
+                arrived.append(events.get_nowait())
+
+            updated = {}
+            for i, delta, result, error in arrived:
+                if error is not None and not isinstance(error, ApiError):
+                    raise error
+                if delta:
+                    texts[i] += delta
+                    updated.setdefault(i, (False, None))
+                if result is not None:
+                    results[i] = result
+                    texts[i] = result[0]
+                if result is not None or error is not None:
+                    updated[i] = (True, error)
+                    pending -= 1
+            for i, (done, error) in updated.items():
+                yield i, texts[i], done, error
+
+    for i, (prompt, _) in enumerate(jobs):
+        if results[i] is not None:
+            _log_tokens(prompt, results[i][1])
+            _remember(prompt, results[i][0])
+
+# Stream the answer to one question, yielding the text so far as it grows, context works like in query_gpt
+# Raises an ApiError when the API cannot answer, the finished answer is cached and added to the conversation
+def stream_gpt(prompt, data_summary="", context=None):
+    for _, text, _, error in stream_gpt_batch([(prompt, data_summary)], context):
+        if error is not None:
+            raise error
+        yield text
+
+# (answer, error) for independent (prompt, data_summary) jobs in job order, without touching any session state
+# For headless runs such as the batch pipeline, error is the ApiError of a job the API could not answer
+def complete_batch(jobs, context, max_workers=MAX_CONCURRENT_REQUESTS):
+    with TracedThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_complete, prompt, data_summary, context) for prompt, data_summary in jobs]
+
+    results = []
+    for future in futures:
+        try:
+            results.append((future.result()[0], None))
+        except ApiError as e:
+            results.append((None, e))
+    return results
@@ -0,0 +1,166 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from common import replace_file, to_date, write_json
+from dashboard_jobs import analyse_range, fetch_sources
+from ga4_store import HISTORY_START, load_ga4_cube
+from rate_limit import CONCURRENCY, install_budgets
+from tracing import span
+
+# Headless batch run of the dashboard for many clients
+#
+#   python pipeline.py properties.json --workers 8
+#
+# properties.json is a list of property configs, site_url and business_context are optional:
+#
+#   [{"name": "chelsea", "property_id": "123456789", "site_url": "https://www.chelseawnutrition.com/",
+#     "business_context": "The data is from a one-person dietitian business ..."}]
+#
+# Properties are spread over a process pool. Concurrent calls to each API are limited across all workers by shared
+# budgets and each worker takes its share of the per-API request rates, and every tenant gets its own folder under the output directory with its summary tables (parquet), the
+# summaries and analyses (analyses.json) and a record of the run (run.json).
+
+OUTPUT_DIR = os.environ.get("PIPELINE_OUTPUT_DIR", os.path.join("data", "tenants"))
+
+# Worker processes, each one works on one property at a time
+# Mostly waiting on the APIs rather than computing, so this is not tied to the number of CPUs
+MAX_WORKERS = 8
+
+
+# Read and check a list of property configs, a config without a name is named after its property
+def load_configs(path):
+    with open(path) as f:
+        configs = json.load(f)
+
+    names = set()
+    for config in configs:
+        if not config.get("property_id"):
+            raise ValueError(f"Property config without a property_id: {config}")
+        config.setdefault("name", str(config["property_id"]))
+        if config["name"] in names:
+            raise ValueError(f"Duplicate property name: {config['name']}")
+        names.add(config["name"])
+    return configs
+
+
+# Fetch, aggregate and analyse one property
+# Returns {"tables": {name: frame}, "summaries": {name: text}, "analyses": {name: text}, "errors": {name: text}},
+# an analysis the API could not produce is None with its error listed under "errors"
+def build_dashboard(config, start_date=HISTORY_START, end_date=None):
+    start = to_date(start_date)
+    end = to_date(end_date) if end_date else date.today()
+    load_cube = lambda: load_ga4_cube(start.isoformat(), end.isoformat(), property_id=config["property_id"])
+    cube, search_data = fetch_sources(load_cube, config.get("site_url"), start, end)
+
+    result = analyse_range(cube, search_data, start, end, config.get("business_context"))
+    return {
+        "tables": result["tables"],
+        "summaries": {name: summary for name, (_, summary) in result["jobs"].items()},
+        "analyses": result["analyses"],
+        "errors": result["errors"],
+    }
+
+
+def _write_outputs(tenant_dir, result):
+    os.makedirs(tenant_dir, exist_ok=True)
+    for name, table in result["tables"].items():
+        replace_file(os.path.join(tenant_dir, f"{name}.parquet"), lambda tmp_path: table.to_parquet(tmp_path, index=False))
+    write_json(os.path.join(tenant_dir, "analyses.json"), {key: result[key] for key in ("summaries", "analyses", "errors")})
+
+
+# Run one property and write its outputs, a failure is recorded in run.json instead of stopping the run
+def run_property(config, start_date=HISTORY_START, end_date=None, output_dir=OUTPUT_DIR):
+    started = time.perf_counter()
+    tenant_dir = os.path.join(output_dir, config["name"])
+    record = {
+        "name": config["name"],
+        "property_id": config["property_id"],
+        "site_url": config.get("site_url"),
+        "start_date": str(start_date),
+        "end_date": str(end_date or date.today()),
+        "status": "ok",
+        "error": None,
+    }
+    try:
+        with span("pipeline.property", tenant=config["name"]):
+            result = build_dashboard(config, start_date, end_date)
+            _write_outputs(tenant_dir, result)
+        if result["errors"]:
+            record["status"] = "partial"
+            record["error"] = "; ".join(f"{name}: {error}" for name, error in result["errors"].items())
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    record["duration_s"] = round(time.perf_counter() - started, 2)
+    record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    os.makedirs(tenant_dir, exist_ok=True)
+    write_json(os.path.join(tenant_dir, "run.json"), record)
+    return record
+
+
+# Runs in every worker process before its first property, worker_setup() can e.g. install stand-in clients
+def _init_worker(budgets, rate_share, worker_setup=None):
+    install_budgets(budgets, rate_share)
+    if worker_setup:
+        worker_setup()
+
+
+def _print_record(record):
+    print(f"{record['name']:<30} {record['status']:<6} {record['duration_s']:8.1f}s  {record['error'] or ''}")
+
+
+# Run many properties on a process pool, returns the run record of every property in completion order
+# on_record(record) is called as each property finishes. The API budgets are semaphores held by a manager process,
+# so they are shared by all the workers.
+def run_pipeline(configs, start_date=HISTORY_START, end_date=None, output_dir=OUTPUT_DIR, max_workers=MAX_WORKERS,
+                 budgets=None, worker_setup=None, on_record=None):
+    budgets = {**CONCURRENCY, **(budgets or {})}
+    max_workers = max(1, min(max_workers, len(configs)))
+    # Worker processes are started fresh rather than forked from a process that already runs threads
+    mp_context = multiprocessing.get_context("spawn")
+
+    records = []
+    with mp_context.Manager() as manager:
+        shared_budgets = {api: manager.BoundedSemaphore(limit) for api, limit in budgets.items()}
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp_context, initializer=_init_worker, initargs=(shared_budgets, 1 / max_workers, worker_setup),
+        ) as pool:
+            futures = [pool.submit(run_property, config, start_date, end_date, output_dir) for config in configs]
+            for future in as_completed(futures):
+                record = future.result()
+                if on_record:
+                    on_record(record)
+                records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch, aggregate and analyse many properties")
+    parser.add_argument("configs", help="JSON file with the property configs")
+    parser.add_argument("--start", default=HISTORY_START, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", help="Last day, YYYY-MM-DD, defaults to today")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="Folder holding one output folder per property")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--budget", action="append", default=[], metavar="API=N",
+                        help="Concurrent calls allowed for an API across all workers, e.g. --budget openai=4")
+    args = parser.parse_args()
+
+    budgets = {}
+    for item in args.budget:
+        api, limit = item.split("=")
+        budgets[api] = int(limit)
+
+    configs = load_configs(args.configs)
+    started = time.perf_counter()
+    records = run_pipeline(configs, args.start, args.end, args.output, args.workers, budgets, on_record=_print_record)
+    succeeded = sum(record["status"] == "ok" for record in records)
+    print(f"\n{succeeded}/{len(records)} properties done in {time.perf_counter() - started:.1f}s, output in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import shutil
+import time
+from dashboard_jobs import analyse_range, fetch_sources
+from ga4_cube import last_days, window_cube
+from ga4_data_pull import default_property_id
+from ga4_store import load_ga4_windows
+from gsc_data_pull import PROPERTY_URL
+from llm_integration import answer_key
+from snapshot_store import publish_snapshot, read_snapshot, stage_snapshot
+from tracing import span
+
+# Build the dashboard ahead of time and publish it as a snapshot the app loads instantly
+#
+#   python precompute_worker.py [--property-id 123456789] [--site-url https://www.example.com/]
+#
+# Meant to run from cron, e.g. every morning at 6:
+#
+#   0 6 * * *  cd /path/to/GA_connection && python precompute_worker.py
+#
+# It syncs the GA4 store and pulls Search Console like the app would, then writes the running GA4 totals, the
+# search query data and the analyses of the precomputed date ranges as a new snapshot version (see snapshot_store).
+
+# Date ranges whose analyses are precomputed, as days back from the last day (None is all history)
+# They match presets of the app's date range control, so those load without waiting for the API
+PRECOMPUTE_DAYS = (None, 30)
+
+
+# Analyse every precomputed date range of a snapshot
+# Returns {"ranges": [...], "answers": {answer key: answer}}, the app primes its response cache with the answers
+def _analyse(snapshot, context, precompute_days):
+    windows, search_data = snapshot["windows"], snapshot["search_data"]
+    analyses = {"ranges": [], "answers": {}}
+    for length in precompute_days:
+        start, end = last_days(windows, length)
+        result = analyse_range(window_cube(windows, start, end), search_data, start, end, context)
+
+        analyses["ranges"].append({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "analyses": result["analyses"],
+            "errors": result["errors"],
+        })
+        for name, answer in result["analyses"].items():
+            if answer is not None:
+                prompt, data_summary = result["jobs"][name]
+                analyses["answers"][answer_key(prompt, data_summary, result["context"])] = answer
+    return analyses
+
+
+# Fetch, aggregate and analyse one property and publish the result as its new snapshot, returns the version
+# context is the business context the analyses are written against, by default this site's
+def build_snapshot(property_id=None, site_url=None, context=None, precompute_days=PRECOMPUTE_DAYS):
+    started = time.perf_counter()
+    property_id = property_id or default_property_id()
+    site_url = site_url or PROPERTY_URL
+
+    with span("snapshot.build", property_id=property_id) as current:
+        windows, search_data = fetch_sources(lambda: load_ga4_windows(property_id=property_id), site_url)
+        fetched = time.perf_counter()
+
+        staging = stage_snapshot(property_id, windows, search_data)
+        try:
+            # Analyse what was written, so the app's summaries of the loaded snapshot match the precomputed ones
+            analyses = _analyse(read_snapshot(staging), context, precompute_days)
+            version = publish_snapshot(property_id, staging, analyses, {
+                "site_url": site_url,
+                "data_from": windows["days"][0].date().isoformat(),
+                "data_through": windows["days"][-1].date().isoformat(),
+                "search_rows": len(search_data),
+                "fetch_seconds": round(fetched - started, 2),
+                "build_seconds": round(time.perf_counter() - started, 2),
+                "analysis_errors": sum(len(entry["errors"]) for entry in analyses["ranges"]),
+            })
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        current.set(version=version)
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the dashboard and publish it as a snapshot")
+    parser.add_argument("--property-id", help="GA4 property, defaults to GA4_PROPERTY_ID or the app's secrets")
+    parser.add_argument("--site-url", help=f"Search Console site, defaults to {PROPERTY_URL}")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    version = build_snapshot(args.property_id, args.site_url)
+    print(f"Published snapshot {version} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from tracing import current_span
+
+# Shared scheduler for every external API call
+# Calls go through call(api, request, credential), which
+#   - takes a token from the API's bucket and from the bucket of the credential the quota is counted against
+#     (GA4 property, Search Console site, Ads customer, scraped host),
+#   - holds a slot of the API's concurrency budget while the request is in flight,
+#   - retries throttling (429), server errors (5xx) and dropped connections with jittered exponential backoff,
+#     honouring Retry-After, and
+#   - raises an ApiError subclass once a request cannot succeed.
+# A 429 pauses the bucket for every caller and halves its rate, which then recovers step by step on success, so a
+# burst of parallel requests backs off together instead of hammering the quota.
+
+# Requests per second and burst size for each API as a whole
+API_RATES = {
+    "ga4": (10, 20),
+    "search_console": (20, 20),    # 1,200 queries per minute per user
+    "google_ads": (1, 2),          # Keyword Planner allows about one request per second
+    "openai": (8, 8),
+    "http": (50, 100),
+}
+
+# Requests per second and burst size for each credential of an API, see set_credential_rate to change them
+CREDENTIAL_RATES = {
+    "ga4": (5, 10),
+    "search_console": (20, 20),    # 1,200 queries per minute per site
+    "google_ads": (1, 2),
+    "http": (20, 40),              # Per scraped host, site_crawler also caps the requests in flight per host
+}
+
+# Requests in flight per API, the parallel fetch paths all draw from these
+CONCURRENCY = {"ga4": 10, "search_console": 8, "google_ads": 2, "openai": 8, "http": 32}
+
+# Attempts after the first one, and the backoff bounds in seconds
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Statuses worth another try
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Packages whose exceptions are API or transport failures, anything else raised by a request (TypeError, KeyError ...)
+# is a bug and propagates unchanged
+_API_ERROR_MODULES = (
+    "openai", "requests", "urllib3", "httpx", "httplib2", "googleapiclient", "google.api_core", "google.auth",
+    "google.ads", "grpc",
+)
+
+# gRPC status names (GA4 and Google Ads clients) as HTTP statuses
+_GRPC_STATUSES = {"RESOURCE_EXHAUSTED": 429, "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504, "INTERNAL": 500}
+
+
+# Base of every error raised by call(), the original exception is kept as __cause__
+class ApiError(Exception):
+    def __init__(self, api, message, status=None):
+        super().__init__(f"{api} request failed{f' ({status})' if status else ''}: {message}")
+        self.api = api
+        self.status = status
+
+
+# Still throttled (429) after every retry
+class RateLimitError(ApiError):
+    pass
+
+
+# Server errors, timeouts or dropped connections that did not clear up within the retries
+class ServiceUnavailableError(ApiError):
+    pass
+
+
+# Rejected outright (bad request, permissions, not found ...), retrying would not help
+class RequestError(ApiError):
+    pass
+
+
+# Token bucket refilled at `rate` tokens per second up to `burst`, its rate adapts to throttling
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take one token, waiting as long as needed, returns the seconds waited
+    def acquire(self):
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + max(0, now - self._updated) * self.rate)
+                self._updated = max(now, self._updated)
+                if now >= self._updated and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = max(self._updated - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    # Hand out nothing for `seconds` and halve the rate, every caller of the bucket backs off together
+    def throttle(self, seconds):
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self._tokens = 0
+            self._updated = max(self._updated, time.monotonic() + seconds)
+
+    # Win back a tenth of the configured rate after a successful call
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+_budgets = {}
+_buckets = {}
+_credential_rates = {}
+_rate_share = 1.0
+_lock = threading.Lock()
+
+
+# Change the rate of one credential of an API (e.g. a scraped host), or of all its credentials when credential is None
+def set_credential_rate(api, rate, burst, credential=None):
+    with _lock:
+        if credential is None:
+            CREDENTIAL_RATES[api] = (rate, burst)
+            for key in [key for key in _buckets if key[0] == api and key[1] is not None and key not in _credential_rates]:
+                del _buckets[key]
+        else:
+            _credential_rates[(api, credential)] = (rate, burst)
+            _buckets.pop((api, credential), None)
+
+
+# Replace the concurrency budgets, budgets maps an API name to a semaphore (e.g. one shared by several processes)
+# rate_share scales the API-wide token buckets, a process running alongside n - 1 others takes 1 / n of each rate
+# (credentials are not shared between processes, e.g. each pipeline worker has its own properties)
+def install_budgets(budgets, rate_share=1.0):
+    global _rate_share
+    with _lock:
+        _budgets.update(budgets)
+        _rate_share = rate_share
+        _buckets.clear()
+
+
+def _semaphore(api):
+    if api not in _budgets and api in CONCURRENCY:
+        with _lock:
+            if api not in _budgets:
+                _budgets[api] = threading.BoundedSemaphore(CONCURRENCY[api])
+    return _budgets.get(api)
+
+
+def _bucket(api, credential):
+    rates = API_RATES if credential is None else CREDENTIAL_RATES
+    key = (api, credential)
+    if key not in _buckets and (api in rates or key in _credential_rates):
+        with _lock:
+            if key not in _buckets:
+                rate, burst = _credential_rates.get(key) or rates[api]
+                share = _rate_share if credential is None else 1.0
+                _buckets[key] = TokenBucket(rate * share, max(1, burst * share))
+    return _buckets.get(key)
+
+
+# Hold one slot of an API's concurrency budget for the duration of a call
+@contextmanager
+def budget(api):
+    semaphore = _semaphore(api)
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+# HTTP status of an exception from any of the API clients, None when it has none (e.g. a dropped connection)
+def error_status(error):
+    response = getattr(error, "response", None)
+    for value in (
+        getattr(error, "status_code", None),                       # openai
+        getattr(response, "status_code", None),                    # requests
+        getattr(getattr(error, "resp", None), "status", None),     # googleapiclient HttpError
+        getattr(error, "code", None),                              # google.api_core
+        getattr(getattr(error, "error", None), "code", None),      # GoogleAdsException wraps the gRPC call
+    ):
+        if callable(value):
+            value = value()
+        if isinstance(value, int):
+            return value
+        if value is not None and getattr(value, "name", None) in _GRPC_STATUSES:
+            return _GRPC_STATUSES[value.name]
+    return None
+
+
+# Whether an exception comes from the API or the network rather than from our own code
+def is_api_error(error):
+    if isinstance(error, OSError):  # connection, timeout and socket errors
+        return True
+    module = type(error).__module__ or ""
+    return any(module == name or module.startswith(name + ".") for name in _API_ERROR_MODULES)
+
+
+# The ApiError an API or transport failure is raised as once no (further) retry is possible
+def as_api_error(api, error, retries=None):
+    status = error_status(error)
+    if not _retryable(error, status):
+        return RequestError(api, error, status)
+    if retries is None:
+        return ServiceUnavailableError(api, error, status)
+    error_type = RateLimitError if status == 429 else ServiceUnavailableError
+    return error_type(api, f"{error} (after {retries} retries)", status)
+
+
+def _retryable(error, status):
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or "Timeout" in name or "Connection" in name
+
+
+# Seconds the server asked us to wait, if it said
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "resp", None)
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+# Full jitter: anywhere between no wait and the exponential bound
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# Run request() under the API's rate limits and concurrency budget, retrying throttling and transient failures
+# credential names what the quota is counted against (property, site, customer, host), None for the API as a whole
+# Exceptions that are not API or transport failures are raised unchanged and never retried
+def call(api, request, credential=None, retries=MAX_RETRIES):
+    buckets = [bucket for bucket in (_bucket(api, None), _bucket(api, credential) if credential is not None else None) if bucket]
+    span = current_span()
+    waited = 0
+
+    for attempt in range(retries + 1):
+        waited += sum(bucket.acquire() for bucket in buckets)
+        try:
+            with budget(api):
+                result = request()
+        except Exception as e:
+            if not is_api_error(e):
+                raise
+            status = error_status(e)
+            if not _retryable(e, status) or attempt == retries:
+                raise as_api_error(api, e, retries) from e
+
+            delay = _retry_after(e) or backoff(attempt)
+            if status == 429:
+                for bucket in buckets:
+                    bucket.throttle(delay)
+            if span:
+                span.set(retries=attempt + 1, last_retry_status=status)
+            time.sleep(delay)
+            continue
+
+        for bucket in buckets:
+            bucket.succeeded()
+        if span and waited:
+            span.set(throttle_wait_ms=round(waited * 1000, 1))
+        return result
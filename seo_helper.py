@@ -1,86 +1,86 @@
 import streamlit as st
-from urllib.parse import unquote
-import gsc_data_pull 
-import requests
-from bs4 import BeautifulSoup
-from llm_integration import query_gpt 
+from gsc_data_pull import summarize_search_queries
+from handoff_store import HANDOFF_PARAM, handoff_store
+from llm_integration import PROMPT_SECTION_BUDGETS, fit_text, stream_gpt
+from data_cache import cached
+from llm_context import count_tokens
+from rate_limit import ApiError
+from site_crawler import crawl_site, fetch_html, make_soup, parse_page_copy
+from tracing import traced
 
 # Page configuration
 st.set_page_config(layout="wide")
 
+# Tokens of the prompt's data section given to the search queries handed over by the dashboard, the page copy gets the rest
+SEARCH_QUERY_TOKENS = 400
+
+# Failed fetches are not cached so they are retried on the next run
+@traced()
+@cached("page_copy", cache_if=lambda seo_data: "Error" not in seo_data)
 def fetch_page_copy(url):
     try:
-        # Fetch the content of the page
-        response = requests.get(url)
-        response.raise_for_status()  # Check if request was successful
-
-        # Parse the page content
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Extract the title tag
-        title = soup.title.string if soup.title else "No title found"
-
-        # Extract the meta description
-        meta_description = ""
-        description_tag = soup.find("meta", attrs={"name": "description"})
-        if description_tag and description_tag.get("content"):
-            meta_description = description_tag["content"]
-        else:
-            meta_description = "No meta description found"
-
-        # Extract meta keywords
-        meta_keywords = ""
-        keywords_tag = soup.find("meta", attrs={"name": "keywords"})
-        if keywords_tag and keywords_tag.get("content"):
-            meta_keywords = keywords_tag["content"]
-        else:
-            meta_keywords = "No meta keywords found"
-
-        # Extract main text from <p> and heading tags
-        paragraphs = soup.find_all(['p', 'h1', 'h2', 'h3'])
-        page_text = "\n\n".join([para.get_text(strip=True) for para in paragraphs])
-
-        # Combine all extracted data into a dictionary
-        seo_data = {
-            "Title": title,
-            "Meta Description": meta_description,
-            "Meta Keywords": meta_keywords,
-            "Page Copy": page_text if page_text else "No main content found on this page."
-        }
-
-        return seo_data
-    except requests.RequestException as e:
+        # Fetch the content of the page over the shared session, revalidating any local copy
+        soup = make_soup(fetch_html(url))
+
+        # Extract the title, meta tags and main copy
+        return parse_page_copy(soup)
+    except ApiError as e:
         return {"Error": f"An error occurred while fetching the page: {e}"}
 
-def display_report_with_llm(llm_prompt):
-    # Query the LLM with the prompt
-    llm_response = query_gpt(llm_prompt)
+def display_report_with_llm(llm_prompt, data_summary=""):
+    # Query the LLM with the prompt, the answer is shown as it streams in
     st.write("GPT-4 Analysis:")
-    st.write(llm_response)
+    answer_slot = st.empty()
+    try:
+        for llm_response in stream_gpt(llm_prompt, data_summary):
+            answer_slot.markdown(llm_response + " ▌")
+    except ApiError as e:
+        answer_slot.error(f"The analysis could not be generated: {e}")
+        return
+    answer_slot.markdown(llm_response)
+
+# The analysis and search query data handed over by the dashboard as (message, search_data)
+# search_data is None when the link carried no (or an expired) handoff, links with ?message= still work
+def read_handoff():
+    query_params = st.experimental_get_query_params()
+    handoff_id = query_params.get(HANDOFF_PARAM, [None])[0]
+    handoff = handoff_store.get(handoff_id) if handoff_id else None
+    if handoff is not None:
+        return handoff["payload"].get("message", "No message received"), handoff["frames"].get("search_data")
+    if handoff_id:
+        st.warning("The analysis passed from the dashboard has expired, open the SEO helper from the dashboard again.")
+    return query_params.get("message", ["No message received"])[0], None
 
 def main():
     # Ensure session_summary is initialized in session state
     if "session_summary" not in st.session_state:
         st.session_state["session_summary"] = ""  # Initialize with an empty string or default value
 
-    
-    # Pull the same dataframe as in the main app
-    df = gsc_data_pull.fetch_search_console_data()  # Replace 'pull_data' with the actual function name
-    
-    # Retrieve message from URL parameter
-    query_params = st.experimental_get_query_params()
-    message = query_params.get("message", ["No message received"])[0]
+    # The dashboard's search query analysis and data, read from the handoff store instead of fetched again
+    message, search_data = read_handoff()
 
     # Display SEO helper app
     st.title("SEO Helper")
     st.write("This is the SEO helper app.")
 
+    # Crawl mode audits every page of a site instead of a single URL
+    crawl_mode = st.checkbox("Crawl the whole site (sitemap or seed URL)")
+
     # Input field for the URL to scrape
     url = st.text_input("Enter a URL to scrape", placeholder="https://example.com")
-    
-    if url:
+
+    if url and crawl_mode:
+        with st.spinner("Crawling site..."):
+            site_data = crawl_site(url)
+        st.write(f"Fetched {len(site_data)} pages.")
+        st.dataframe(site_data, use_container_width=True)
+        st.download_button("Download as CSV", site_data.to_csv(index=False), file_name="site_copy.csv")
+    elif url:
         st.write("Fetching content...")
         seo_data = fetch_page_copy(url)
+        if "Error" in seo_data:
+            st.error(seo_data["Error"])
+            return
 
         with st.expander("See Website Copy"):
             st.subheader("SEO Information")
@@ -90,20 +90,32 @@ def main():
             st.subheader("Page Copy")
             st.write(seo_data["Page Copy"])
 
-        # Generate the prompt for LLM analysis
-        llm_prompt = (
+        # The search queries bringing visitors to the site, when the dashboard handed them over
+        query_summary = ""
+        if search_data is not None and not search_data.empty:
+            with st.expander("See Search Queries"):
+                st.dataframe(search_data, use_container_width=True)
+            query_summary = summarize_search_queries(search_data, max_tokens=SEARCH_QUERY_TOKENS) + "\n"
+
+        # The page goes in as the data of the prompt, its copy last so only the copy is cut when the page is too long
+        seo_info = query_summary + (
             f"Here is the SEO information and page copy from a webpage:\n\n"
             f"Title: {seo_data['Title']}\n"
             f"Meta Description: {seo_data['Meta Description']}\n"
             f"Meta Keywords: {seo_data['Meta Keywords']}\n"
-            f"Page Copy: {seo_data['Page Copy']}\n\n"
+            f"Page Copy: "
+        )
+        page_data = seo_info + fit_text(seo_data["Page Copy"], PROMPT_SECTION_BUDGETS["data"] - count_tokens(seo_info))
+
+        # Generate the prompt for LLM analysis
+        llm_prompt = (
             f"Based on this SEO information, please suggest possible improvements. Have one section main section that talks about overall SEO strategy. Below that have another section where you identify actual pieces of text you see that could be tweaked."
             f"Use the following context to guide your suggestions: {message}. "
             f"This is an analysis from an initial look at the search query report from this website."
         )
 
         # Display LLM analysis
-        display_report_with_llm(llm_prompt)
+        display_report_with_llm(llm_prompt, page_data)
  
 if __name__ == "__main__":
      main()
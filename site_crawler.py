@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import threading
+import xml.etree.ElementTree as ET
+from urllib.parse import urldefrag, urljoin, urlparse
+import pandas as pd
+from bs4 import BeautifulSoup
+from clients import get_client
+from rate_limit import call, set_credential_rate
+from tracing import TracedThreadPoolExecutor
+
+# lxml is a much faster parser backend than the pure-Python html.parser, used when installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Folder holding the last response of every fetched URL, used for conditional GETs
+CRAWL_CACHE_DIR = os.environ.get("CRAWL_CACHE_DIR", os.path.join("data", "crawl_cache"))
+
+# Seconds to wait for a server before giving up on a page
+HTTP_TIMEOUT = 15
+
+# Total pages fetched at the same time, and at most this many against any single host
+MAX_WORKERS = 16
+PER_HOST_LIMIT = 4
+
+# Requests per second and burst against any single host, paced by the shared scheduler
+HOST_RATE = (20, 40)
+set_credential_rate("http", *HOST_RATE)
+
+# Upper bound on the pages visited in one crawl
+MAX_PAGES = 300
+
+# Links to files that are not HTML pages are not followed
+_SKIPPED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".zip", ".mp4", ".mp3", ".css", ".js", ".xml")
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def _host_limit(url):
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_limits[host]
+
+
+# Pace one host differently, e.g. a slow site or our own site that can take more
+def set_host_rate(host, rate, burst):
+    set_credential_rate("http", rate, burst, credential=host)
+
+
+def _cache_path(url):
+    return os.path.join(CRAWL_CACHE_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+
+def _read_cached(url):
+    try:
+        with open(_cache_path(url)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached(url, response):
+    os.makedirs(CRAWL_CACHE_DIR, exist_ok=True)
+    path = _cache_path(url)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "text": response.text,
+        }, f)
+    os.replace(tmp_path, path)
+
+
+def _get(url, headers):
+    with _host_limit(url):
+        response = get_client("http").get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()  # Check if request was successful
+    return response
+
+
+# GET a URL over the pooled session, revalidating the locally cached copy with ETag/Last-Modified
+# Returns the body text, an unchanged page (304) is served from the local copy
+# Requests are paced per host by the shared scheduler, which raises an ApiError for a page that cannot be fetched
+def fetch_html(url):
+    cached = _read_cached(url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = call("http", lambda: _get(url, headers), credential=urlparse(url).netloc)
+    if response.status_code == 304 and cached:
+        return cached["text"]
+
+    if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+        _write_cached(url, response)
+    return response.text
+
+
+# Extract the title, meta tags and main copy the SEO helper works with
+def parse_page_copy(soup):
+    # Extract the title tag
+    title = soup.title.string if soup.title and soup.title.string else "No title found"
+
+    # Extract the meta description
+    description_tag = soup.find("meta", attrs={"name": "description"})
+    if description_tag and description_tag.get("content"):
+        meta_description = description_tag["content"]
+    else:
+        meta_description = "No meta description found"
+
+    # Extract meta keywords
+    keywords_tag = soup.find("meta", attrs={"name": "keywords"})
+    if keywords_tag and keywords_tag.get("content"):
+        meta_keywords = keywords_tag["content"]
+    else:
+        meta_keywords = "No meta keywords found"
+
+    # Extract main text from <p> and heading tags
+    paragraphs = soup.find_all(['p', 'h1', 'h2', 'h3'])
+    page_text = "\n\n".join([para.get_text(strip=True) for para in paragraphs])
+
+    return {
+        "Title": title,
+        "Meta Description": meta_description,
+        "Meta Keywords": meta_keywords,
+        "Page Copy": page_text if page_text else "No main content found on this page."
+    }
+
+
+def make_soup(html):
+    return BeautifulSoup(html, HTML_PARSER)
+
+
+# Same-host page links found on a page, without fragments
+def _page_links(soup, base_url):
+    host = urlparse(base_url).netloc
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urldefrag(urljoin(base_url, anchor["href"]))[0]
+        parsed = urlparse(link)
+        if parsed.scheme in ("http", "https") and parsed.netloc == host and not parsed.path.lower().endswith(_SKIPPED_EXTENSIONS):
+            links.append(link)
+    return links
+
+
+# Page URLs listed in a sitemap, sitemap indexes are followed
+def sitemap_urls(sitemap_url, max_urls=MAX_PAGES):
+    root = ET.fromstring(fetch_html(sitemap_url).encode("utf-8"))
+    locations = [element.text.strip() for element in root.iter() if element.tag.endswith("loc") and element.text]
+
+    if root.tag.endswith("sitemapindex"):
+        urls = []
+        for child_sitemap in locations:
+            urls.extend(sitemap_urls(child_sitemap, max_urls - len(urls)))
+            if len(urls) >= max_urls:
+                break
+        return urls[:max_urls]
+    return locations[:max_urls]
+
+
+# Fetch and parse one page, returning its record and the links found on it
+def _crawl_page(url):
+    try:
+        soup = make_soup(fetch_html(url))
+    except Exception as e:
+        return {"URL": url, "Error": f"An error occurred while fetching the page: {e}"}, []
+    return {"URL": url, **parse_page_copy(soup)}, _page_links(soup, url)
+
+
+# Crawl a whole site and return one Title/Meta/Page Copy record per page
+# start is either a sitemap (.xml) or a seed page; for a seed page the site's /sitemap.xml is tried first and
+# links are followed breadth first when there is none
+def crawl_site(start, max_pages=MAX_PAGES, max_workers=MAX_WORKERS):
+    if start.lower().endswith(".xml"):
+        urls = sitemap_urls(start, max_pages)
+    else:
+        parsed = urlparse(start)
+        try:
+            urls = sitemap_urls(f"{parsed.scheme}://{parsed.netloc}/sitemap.xml", max_pages)
+        except Exception:
+            urls = []
+
+    records = []
+    with TracedThreadPoolExecutor(max_workers=max_workers) as pool:
+        if urls:
+            records = [record for record, _ in pool.map(_crawl_page, urls)]
+        else:
+            seen = {start}
+            frontier = [start]
+            while frontier and len(records) < max_pages:
+                batch = frontier[:max_pages - len(records)]
+                frontier = []
+                for record, links in pool.map(_crawl_page, batch):
+                    records.append(record)
+                    for link in links:
+                        if link not in seen:
+                            seen.add(link)
+                            frontier.append(link)
+
+    columns = ["URL", "Title", "Meta Description", "Meta Keywords", "Page Copy", "Error"]
+    return pd.DataFrame(records).reindex(columns=columns)
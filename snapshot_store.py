@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from common import write_json
+from data_cache import cached
+from frame_memory import compact_frame
+
+# Versioned dashboard snapshots written by precompute_worker.py and loaded by the app
+# Laid out as <property>/<version>/ with a LATEST file naming the current version:
+#   meta.json            freshness metadata (when it was built, which days it covers ...)
+#   windows.json         days and value labels of the running GA4 totals
+#   keys-<i>.npy         (day, value) keys of the running totals of each dimension, memory-mapped on load
+#   cum-<i>.npy          the running totals themselves, memory-mapped on load
+#   search_queries.parquet
+#   analyses.json        LLM analyses of the precomputed date ranges
+# A version is written in full under a staging name and only then made LATEST, so readers never see half a snapshot.
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+
+# Versions kept per property, older ones are removed when a new one is published
+KEEP_SNAPSHOTS = 5
+
+# Snapshots older than this are flagged as stale by the app
+MAX_SNAPSHOT_AGE_HOURS = float(os.environ.get("MAX_SNAPSHOT_AGE_HOURS", 24))
+
+# Layout version, snapshots written in another layout are ignored
+# 2: sparse running totals (keys and cum) instead of dense (days, values, metrics) arrays
+SNAPSHOT_FORMAT = 2
+
+LATEST_FILE = "LATEST"
+
+
+def _property_dir(property_id):
+    return os.path.join(SNAPSHOT_DIR, str(property_id))
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Write the data of a new snapshot to a staging folder and return its path
+# windows is the prefix sum structure from ga4_cube.build_prefix_sums
+def stage_snapshot(property_id, windows, search_data):
+    property_dir = _property_dir(property_id)
+    os.makedirs(property_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=property_dir)
+
+    dimensions = list(windows["sums"])
+    write_json(os.path.join(staging, "windows.json"), {
+        "first_day": windows["days"][0].date().isoformat(),
+        "days": len(windows["days"]),
+        "dimensions": dimensions,
+        "labels": {dim: [str(label) for label in windows["labels"][dim]] for dim in dimensions},
+    })
+    for i, dim in enumerate(dimensions):
+        for part in ("keys", "cum"):
+            np.save(os.path.join(staging, f"{part}-{i}.npy"), np.ascontiguousarray(windows["sums"][dim][part]))
+    search_data.to_parquet(os.path.join(staging, "search_queries.parquet"), index=False)
+    return staging
+
+
+# Load a snapshot folder, the running totals are memory-mapped rather than read into memory
+def read_snapshot(path):
+    layout = _read_json(os.path.join(path, "windows.json"))
+    windows = {
+        "days": pd.date_range(layout["first_day"], periods=layout["days"], freq="D", name="Date"),
+        "labels": {dim: pd.Index(labels, dtype=object, name=dim) for dim, labels in layout["labels"].items()},
+        "sums": {
+            dim: {part: np.load(os.path.join(path, f"{part}-{i}.npy"), mmap_mode="r") for part in ("keys", "cum")}
+            for i, dim in enumerate(layout["dimensions"])
+        },
+    }
+
+    search_data = pd.read_parquet(os.path.join(path, "search_queries.parquet"))
+    snapshot = {
+        "path": path,
+        "windows": windows,
+        "search_data": search_data,
+        # Arrow-backed copy for display, Streamlit serializes it without converting the query strings one by one
+        "search_display": compact_frame(search_data, arrow=True),
+        "meta": {},
+        "analyses": {},
+    }
+    for name in ("meta", "analyses"):
+        file_path = os.path.join(path, f"{name}.json")
+        if os.path.exists(file_path):
+            snapshot[name] = _read_json(file_path)
+    return snapshot
+
+
+# Finish a staged snapshot with its analyses and metadata, make it the LATEST version and prune old versions
+# Returns the version name
+def publish_snapshot(property_id, staging, analyses, meta):
+    property_dir = _property_dir(property_id)
+    created_at = datetime.now(timezone.utc)
+    version = created_at.strftime("%Y%m%dT%H%M%S%fZ")
+
+    write_json(os.path.join(staging, "analyses.json"), analyses)
+    write_json(os.path.join(staging, "meta.json"), {
+        **meta,
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "property_id": str(property_id),
+        "created_at": created_at.isoformat(timespec="seconds"),
+    })
+    os.rename(staging, os.path.join(property_dir, version))
+
+    tmp_path = os.path.join(property_dir, LATEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(property_dir, LATEST_FILE))
+
+    versions = sorted(name for name in os.listdir(property_dir) if not name.startswith(".") and name != LATEST_FILE)
+    for old in versions[:-KEEP_SNAPSHOTS]:
+        shutil.rmtree(os.path.join(property_dir, old), ignore_errors=True)
+    return version
+
+
+# Path of a property's current snapshot, None when none has been published (in the current layout)
+def latest_snapshot_path(property_id):
+    property_dir = _property_dir(property_id)
+    try:
+        with open(os.path.join(property_dir, LATEST_FILE)) as f:
+            path = os.path.join(property_dir, f.read().strip())
+        meta = _read_json(os.path.join(path, "meta.json"))
+    except (OSError, ValueError):
+        return None
+    return path if meta.get("format") == SNAPSHOT_FORMAT else None
+
+
+# A snapshot never changes once published, so it is cached under its path until a newer version replaces it
+@cached("snapshot", key=lambda path: (path,))
+def _load_snapshot(path):
+    return read_snapshot(path)
+
+
+# The current snapshot of a property, None when there is none yet
+def load_latest_snapshot(property_id):
+    path = latest_snapshot_path(property_id)
+    return _load_snapshot(path) if path else None
+
+
+# Age of a snapshot in hours
+def snapshot_age_hours(snapshot):
+    created_at = datetime.fromisoformat(snapshot["meta"]["created_at"])
+    return (datetime.now(timezone.utc) - created_at).total_seconds() / 3600
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from llm_context import count_tokens
+
+# Column separators for the supported text encodings
+SEPARATORS = {
+    "pipe": " | ",
+    "csv": ",",
+    "tsv": "\t",
+}
+
+# Tokens a data summary may take up in a prompt by default
+SUMMARY_TOKEN_BUDGET = 1500
+
+
+# Keep the rows worth sending to the LLM: optionally only those at or above a percentile of rank_by,
+# then the first top_n rows (the frame is sorted by rank_by, highest first, when it is given)
+# rank_by is a column or a list of columns, later ones break ties, the percentile applies to the first
+def cut_rows(df, rank_by=None, top_n=None, percentile=None):
+    if rank_by is not None:
+        df = df.sort_values(by=rank_by, ascending=False)
+        primary = rank_by[0] if isinstance(rank_by, list) else rank_by
+        if percentile is not None and not df.empty:
+            df = df[df[primary] >= df[primary].quantile(percentile)]
+    if top_n is not None:
+        df = df.head(top_n)
+    return df
+
+
+# Render a summary table as compact text for an LLM prompt
+# Whole columns are formatted at once, formatters maps a column to a function taking and returning a Series.
+# With max_tokens only the leading (highest ranked) rows that fit are kept, the rest are folded into one row built by
+# aggregate(rows), a dict of column values, or just counted in a closing line when there is no aggregate.
+def render_table(df, title=None, fmt="pipe", rank_by=None, top_n=None, percentile=None, formatters=None,
+                 max_tokens=None, aggregate=None):
+    if fmt not in SEPARATORS:
+        raise ValueError(f"Unknown summary format: {fmt}")
+
+    df = cut_rows(df, rank_by=rank_by, top_n=top_n, percentile=percentile)
+    title_lines = [title] if title else []
+    if max_tokens is None:
+        header, rows = _render_lines(df, fmt, formatters)
+        return _join(title_lines + header + rows)
+
+    # Every row takes at least a token, so no more rows than that can fit. Each rendered row is counted once, the rows
+    # that fit are then read off the running total of the counts.
+    candidates = min(len(df), max(0, max_tokens))
+    header, row_lines = _render_lines(df.iloc[:candidates], fmt, formatters)
+    running = np.cumsum([0] + [count_tokens(line + "\n") for line in row_lines])
+    header_tokens = count_tokens(_join(title_lines + header))
+
+    def tail_lines(rows):
+        if rows == len(df):
+            return []
+        tail = df.iloc[rows:]
+        if aggregate:
+            return _render_lines(pd.DataFrame([aggregate(tail)], columns=df.columns), fmt, formatters)[1]
+        return [f"({len(tail):,} more rows left out)"]
+
+    # The tail row (and how text counts once joined) can push a cut over the budget, cut again by the overshoot
+    budget = max_tokens
+    while True:
+        rows = int(np.searchsorted(running, budget - header_tokens, side="right")) - 1
+        rows = max(0, min(rows, candidates))
+        text = _join(title_lines + header + row_lines[:rows] + tail_lines(rows))
+        overshoot = count_tokens(text) - max_tokens
+        if overshoot <= 0:
+            return text
+        if rows == 0:
+            break
+        budget -= overshoot
+
+    # Not even the header and the tail row fit, drop the tail row, then the title
+    for lines in (title_lines + header, header):
+        text = _join(lines)
+        if count_tokens(text) <= max_tokens:
+            return text
+    return ""
+
+
+def _join(lines):
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+# Text of each cell on one line: line breaks become spaces, the column separator is escaped (pipe) or replaced
+def _clean_cells(values, fmt):
+    values = values.str.replace(r"[\r\n]+", " ", regex=True)
+    if fmt == "pipe":
+        return values.str.replace("|", "\\|", regex=False)
+    if fmt == "tsv":
+        return values.str.replace("\t", " ", regex=False)
+    return values
+
+
+# (header lines, one line per row) of a table, csv cells holding the separator are quoted by to_csv
+def _render_lines(df, fmt, formatters):
+    separator = SEPARATORS[fmt]
+
+    # Format column by column, never row by row
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if formatters and name in formatters:
+            values = formatters[name](values)
+        columns[name] = _clean_cells(values.astype(str), fmt)
+    text_df = pd.DataFrame(columns, index=df.index)
+
+    if fmt == "pipe":
+        header = separator.join(text_df.columns)
+        if text_df.empty:
+            return [header, "-" * len(header)], []
+        body = text_df.iloc[:, 0].str.cat(text_df.iloc[:, 1:], sep=separator)
+        return [header, "-" * len(header)], body.tolist()
+
+    lines = text_df.to_csv(sep=separator, index=False, lineterminator="\n").rstrip("\n").split("\n")
+    return lines[:1], lines[1:]
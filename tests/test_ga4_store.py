@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+import ga4_store
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ga4_store, "STORE_DIR", str(tmp_path))
+
+
+# Stand-in for a report fetch, one row per day and a record of the ranges requested
+class DailyFetch:
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, start_date, end_date):
+        self.ranges.append((start_date, end_date))
+        days = pd.date_range(start_date, end_date, freq="D")
+        return pd.DataFrame({"Date": days, "Sessions": range(len(days))})
+
+
+def test_sync_before_the_stored_range_fills_the_gap():
+    fetch = DailyFetch()
+    ga4_store.sync_report("p", "daily", fetch, "2024-06-01", "2024-12-31")
+    ga4_store.sync_report("p", "daily", fetch, "2024-01-01", "2024-02-28")
+
+    assert fetch.ranges[-1] == ("2024-01-01", "2024-05-31")
+    manifest = ga4_store.read_manifest("p", "daily")
+    assert (manifest["start"].isoformat(), manifest["synced_through"].isoformat()) == ("2024-01-01", "2024-12-31")
+    assert len(ga4_store.read_report("p", "daily", "2024-01-01", "2024-12-31")) == 366
+
+
+def test_sync_after_the_stored_range_fills_the_gap():
+    fetch = DailyFetch()
+    ga4_store.sync_report("p", "daily", fetch, "2024-01-01", "2024-01-31")
+    ga4_store.sync_report("p", "daily", fetch, "2024-03-01", "2024-03-31")
+
+    assert fetch.ranges[-1] == ("2024-02-01", "2024-03-31")
+    assert len(ga4_store.read_report("p", "daily", "2024-01-01", "2024-03-31")) == 91
+
+
+def test_synced_report_without_rows_reads_as_empty_frame():
+    empty = lambda start_date, end_date: pd.DataFrame({"Date": pd.to_datetime([]), "Leads": pd.Series([], dtype="float64")})
+    ga4_store.sync_report("p", "leads", empty, "2024-01-01", "2024-01-31")
+
+    df = ga4_store.read_report("p", "leads", "2024-01-01", "2024-01-31")
+    assert df is not None and df.empty
+    assert list(df.columns) == ["Date", "Leads"]
+
+
+def test_report_never_synced_reads_as_none():
+    assert ga4_store.read_report("p", "missing", "2024-01-01", "2024-01-31") is None
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from llm_context import count_tokens
+from summary_render import render_table
+
+
+def _queries(count):
+    return pd.DataFrame({
+        "Query": [f"query number {i}" for i in range(count)],
+        "Impressions": range(count, 0, -1),
+    })
+
+
+def _other(rows):
+    return {"Query": f"(other {len(rows)} queries)", "Impressions": rows["Impressions"].sum()}
+
+
+@pytest.mark.parametrize("max_tokens", [0, 5, 10, 20, 50, 200])
+def test_tiny_budgets_are_never_exceeded(max_tokens):
+    text = render_table(_queries(500), title="Search Queries by Impressions:", rank_by="Impressions",
+                        max_tokens=max_tokens, aggregate=_other)
+    assert count_tokens(text) <= max_tokens
+
+
+def test_budget_keeps_top_rows_and_folds_the_rest():
+    text = render_table(_queries(500), title="Queries:", rank_by="Impressions", max_tokens=200, aggregate=_other)
+    lines = text.splitlines()
+    assert lines[3] == "query number 0 | 500"
+    assert lines[-1].startswith("(other ")
+    kept = len(lines) - 4
+    assert lines[-1] == f"(other {500 - kept} queries) | {sum(range(1, 501 - kept))}"
+
+
+def test_whole_table_when_it_fits():
+    text = render_table(_queries(3), rank_by="Impressions", max_tokens=1000, aggregate=_other)
+    assert "(other" not in text
+    assert text.count("\n") == 5
+
+
+@pytest.mark.parametrize("max_tokens", [None, 1000])
+def test_multi_line_cells_stay_on_one_row(max_tokens):
+    df = pd.DataFrame({"Query": ["first line\nsecond line", "a | b", "plain"], "Impressions": [3, 2, 1]})
+    lines = render_table(df, rank_by="Impressions", max_tokens=max_tokens).splitlines()
+    assert lines[2:] == ["first line second line | 3", "a \\| b | 2", "plain | 1"]
+
+
+def test_csv_cells_stay_on_one_row():
+    df = pd.DataFrame({"Query": ["first\r\nsecond", "a,b"], "Impressions": [2, 1]})
+    lines = render_table(df, fmt="csv", max_tokens=1000).splitlines()
+    assert lines == ["Query,Impressions", "first second,2", '"a,b",1']
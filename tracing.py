@@ -0,0 +1,173 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+import pandas as pd
+
+# Lightweight tracing of the request paths
+# Every span records its wall time plus whatever the code knows about the work done (rows, bytes, tokens ...),
+# is appended as one JSON line to TRACE_LOG_PATH and kept in memory for the app's debug panel.
+# Set TRACE_LOG_PATH to an empty string to keep spans in memory only.
+
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", os.path.join("data", "traces.jsonl"))
+
+# Size at which the trace log is rotated to <path>.1 (older logs move up to .2 ...), and how many rotated logs are kept
+TRACE_LOG_MAX_BYTES = int(os.environ.get("TRACE_LOG_MAX_BYTES", 10 * 1024 * 1024))
+TRACE_LOG_BACKUPS = 3
+
+# Spans kept in memory for the rollups, oldest are dropped first
+MAX_RECENT_SPANS = 5000
+
+_recent = deque(maxlen=MAX_RECENT_SPANS)
+_write_lock = threading.Lock()
+
+# The innermost open span, a context variable so TracedThreadPoolExecutor can hand it to worker threads
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes = dict(attributes)
+
+    # Attach measurements to the span, e.g. span.set(rows=len(df), bytes=...)
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+# The innermost open span, or None
+def current_span():
+    return _current.get()
+
+
+# Thread pool whose tasks run in a copy of the submitting thread's context
+# Spans opened by the tasks become children of the span that was open when they were submitted
+class TracedThreadPoolExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Move the trace log to <path>.1, <path>.1 to <path>.2 and so on, the oldest is dropped
+def _rotate():
+    for i in range(TRACE_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{TRACE_LOG_PATH}.{i}"):
+            os.replace(f"{TRACE_LOG_PATH}.{i}", f"{TRACE_LOG_PATH}.{i + 1}")
+    os.replace(TRACE_LOG_PATH, f"{TRACE_LOG_PATH}.1")
+
+
+def _export(record):
+    _recent.append(record)
+    if not TRACE_LOG_PATH:
+        return
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        directory = os.path.dirname(TRACE_LOG_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(TRACE_LOG_PATH, "a") as f:
+            f.write(line + "\n")
+            full = f.tell() >= TRACE_LOG_MAX_BYTES
+        if full:
+            try:
+                _rotate()
+            except FileNotFoundError:  # Another process rotated it first
+                pass
+
+
+# Time a block of work, spans opened inside it (on the same thread or in a TracedThreadPoolExecutor) become its children
+# An exception is recorded on the span and re-raised
+@contextmanager
+def span(name, **attributes):
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _current.reset(token)
+        _export({
+            "name": name,
+            "trace_id": current.trace_id,
+            "span_id": current.span_id,
+            "parent_id": current.parent_id,
+            "start": started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(duration_ms, 3),
+            "thread": threading.current_thread().name,
+            "error": error,
+            **current.attributes,
+        })
+
+
+# Default measurements of a traced function's result
+def measure(result):
+    if isinstance(result, pd.DataFrame):
+        return {"rows": len(result), "bytes": int(result.memory_usage(deep=True).sum())}
+    if isinstance(result, str):
+        return {"bytes": len(result.encode("utf-8"))}
+    if isinstance(result, dict):
+        # A cube or a record, count its text payload
+        if "totals" in result:
+            return {"rows": sum(len(frame) for frame in result["totals"].values())}
+        return {"bytes": sum(len(str(value).encode("utf-8")) for value in result.values())}
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], pd.DataFrame):
+        # (summary text, table) as returned by the summarize functions
+        return {"rows": len(result[1]), "bytes": len(str(result[0]).encode("utf-8"))}
+    return {}
+
+
+# Decorator wrapping every call of a function in a span named after it
+# measure(result) returns the attributes recorded from the result
+def traced(name=None, measure=measure):
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name) as current:
+                result = func(*args, **kwargs)
+                if measure:
+                    current.set(**measure(result))
+                return result
+        return wrapper
+    return decorator
+
+
+# Spans recorded by this process, most recent last
+def recent_spans():
+    return list(_recent)
+
+
+# Per span name: calls, errors, p50/p95/max wall time and the summed rows, bytes, tokens, retries and throttling waits
+def rollup(spans=None):
+    df = pd.DataFrame(recent_spans() if spans is None else spans)
+    if df.empty:
+        return pd.DataFrame(columns=["name", "calls", "errors", "p50_ms", "p95_ms", "max_ms"])
+
+    grouped = df.groupby("name", sort=False)
+    summary = pd.DataFrame({
+        "calls": grouped.size(),
+        "errors": grouped["error"].count(),
+        "p50_ms": grouped["duration_ms"].quantile(0.5),
+        "p95_ms": grouped["duration_ms"].quantile(0.95),
+        "max_ms": grouped["duration_ms"].max(),
+    })
+    for column in ("rows", "bytes_before", "bytes", "estimated_prompt_tokens", "prompt_tokens", "completion_tokens", "retries", "throttle_wait_ms"):
+        if column in df.columns:
+            summary[column] = grouped[column].sum(min_count=1)
+    return summary.round(1).sort_values("p95_ms", ascending=False).reset_index()